@@ -0,0 +1,185 @@
+import math
+import time
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from reviews.models import Cart, Ingredient, Recipe, Tag, User
+
+from .shortlinks import get_or_create_short_link
+
+PIXEL_PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADU'
+    'lEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+PERCENTILES = (50, 95, 99)
+SAMPLE_SIZE = 200
+CART_SIZE = 10
+
+
+class BenchmarkData:
+    """Данные сценариев из засеянной базы; пишет в нее корзину и ссылки."""
+
+    def __init__(self, rng):
+        self.reader = User.objects.filter(
+            subscriptions__isnull=False, recipes_count__gt=0
+        ).order_by('-recipes_count', 'id').first()
+        if self.reader is None:
+            raise LookupError('Нет пользователя с подписками и рецептами')
+        self.token, _ = Token.objects.get_or_create(user=self.reader)
+        recipes = list(Recipe.objects.order_by('?').values_list(
+            'id', flat=True)[:SAMPLE_SIZE])
+        self.recipe_ids = recipes
+        self.own_recipe_ids = list(Recipe.objects.filter(
+            author=self.reader).values_list('id', flat=True)[:SAMPLE_SIZE])
+        self.author_ids = list(Recipe.objects.filter(
+            id__in=recipes).values_list('author_id', flat=True).distinct())
+        self.tags = list(Tag.objects.values_list('id', 'slug'))
+        ingredients = list(Ingredient.objects.order_by('?').values_list(
+            'id', 'name')[:SAMPLE_SIZE])
+        self.ingredient_ids = [pk for pk, _ in ingredients]
+        self.ingredient_names = [name for _, name in ingredients]
+        self.words = sorted({word for name in Recipe.objects.filter(
+            id__in=recipes[:20]).values_list('name', flat=True)
+            for word in name.split()})
+        Cart.objects.bulk_create(
+            (Cart(user=self.reader, recipe_id=pk)
+             for pk in rng.sample(recipes, min(CART_SIZE, len(recipes)))),
+            ignore_conflicts=True)
+        self.short_links = [
+            get_or_create_short_link(
+                recipe, f'http://localhost/recipes/{recipe.id}').short_link
+            for recipe in Recipe.objects.filter(id__in=recipes[:50])
+        ]
+
+    def recipe_payload(self, rng):
+        count = min(rng.randint(3, 10), len(self.ingredient_ids))
+        return {
+            'name': f'Рецепт {rng.randint(1, 10 ** 6)}',
+            'text': 'Описание', 'cooking_time': rng.randint(5, 120),
+            'image': PIXEL_PNG,
+            'tags': [pk for pk, _ in rng.sample(
+                self.tags, min(rng.randint(1, 3), len(self.tags)))],
+            'ingredients': [
+                {'id': pk, 'amount': rng.randint(1, 500)}
+                for pk in rng.sample(self.ingredient_ids, count)],
+        }
+
+
+class Scenario:
+    """Запрос к API и бюджет SQL-запросов на него."""
+
+    def __init__(self, name, budget, request, status=200,
+                 anonymous=False):
+        self.name = name
+        self.budget = budget
+        self.request = request
+        self.status = status
+        self.anonymous = anonymous
+
+
+SCENARIOS = (
+    Scenario('recipes-list', 6, lambda data, rng: (
+        'get', '/api/recipes/', {'limit': 6})),
+    Scenario('recipes-list-anonymous', 5, lambda data, rng: (
+        'get', '/api/recipes/', {'limit': 6}), anonymous=True),
+    Scenario('recipes-detail', 5, lambda data, rng: (
+        'get', f'/api/recipes/{rng.choice(data.recipe_ids)}/', {})),
+    Scenario('recipes-create', 19, lambda data, rng: (
+        'post', '/api/recipes/', data.recipe_payload(rng)), status=201),
+    Scenario('recipes-patch', 30, lambda data, rng: (
+        'patch', f'/api/recipes/{rng.choice(data.own_recipe_ids)}/',
+        data.recipe_payload(rng))),
+    Scenario('recipes-filter-tags', 6, lambda data, rng: (
+        'get', '/api/recipes/',
+        {'limit': 6, 'tags': rng.choice(data.tags)[1]})),
+    Scenario('recipes-filter-author', 6, lambda data, rng: (
+        'get', '/api/recipes/',
+        {'limit': 6, 'author': rng.choice(data.author_ids)})),
+    Scenario('recipes-filter-favorited', 6, lambda data, rng: (
+        'get', '/api/recipes/', {'limit': 6, 'is_favorited': 1})),
+    Scenario('recipes-search', 6, lambda data, rng: (
+        'get', '/api/recipes/',
+        {'limit': 6, 'search': rng.choice(data.words)})),
+    Scenario('recipes-popular', 6, lambda data, rng: (
+        'get', '/api/recipes/', {'limit': 6, 'ordering': 'popular'})),
+    Scenario('subscriptions', 4, lambda data, rng: (
+        'get', '/api/users/subscriptions/',
+        {'limit': 6, 'recipes_limit': 3})),
+    Scenario('ingredients-autocomplete', 2, lambda data, rng: (
+        'get', '/api/ingredients/',
+        {'name': rng.choice(data.ingredient_names)[:rng.randint(1, 3)]})),
+    Scenario('short-link-redirect', 1, lambda data, rng: (
+        'get', f'/s/{rng.choice(data.short_links)}/', {}), status=302),
+    Scenario('shopping-list-download', 2, lambda data, rng: (
+        'get', '/api/recipes/download_shopping_cart/', {})),
+)
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def send(client, method, path, payload):
+    if method == 'get':
+        response = client.get(path, payload)
+    else:
+        response = getattr(client, method)(
+            path, payload, content_type='application/json')
+    if response.streaming:
+        # Выгрузка читает базу, пока отдает ответ
+        b''.join(response.streaming_content)
+    return response
+
+
+def run_scenario(client, scenario, data, rng, requests, warmup=0):
+    """Прогоняет сценарий и возвращает задержки, пропускную
+    способность и число запросов к базе."""
+    timings = []
+    queries = []
+    started = None
+    for number in range(warmup + requests):
+        if number == warmup:
+            started = time.perf_counter()
+        method, path, payload = scenario.request(data, rng)
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = send(client, method, path, payload)
+            spent = time.perf_counter() - request_started
+        if response.status_code != scenario.status:
+            raise AssertionError(
+                f'{scenario.name}: {method.upper()} {path} ответил '
+                f'{response.status_code} вместо {scenario.status}')
+        if number >= warmup:
+            timings.append(spent * 1000)
+            queries.append(len(captured))
+    elapsed = time.perf_counter() - started
+    result = {f'p{percent}_ms': round(percentile(timings, percent), 3)
+              for percent in PERCENTILES}
+    result.update({
+        'requests': requests,
+        'rps': round(requests / elapsed, 1),
+        'queries_max': max(queries),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'budget': scenario.budget,
+        'within_budget': max(queries) <= scenario.budget,
+    })
+    return result
+
+
+def run_benchmarks(rng, requests, warmup=0, names=None):
+    data = BenchmarkData(rng)
+    client = Client(SERVER_NAME='localhost',
+                    HTTP_AUTHORIZATION=f'Token {data.token.key}')
+    anonymous = Client(SERVER_NAME='localhost')
+    return {
+        scenario.name: run_scenario(
+            anonymous if scenario.anonymous else client, scenario, data,
+            rng, requests, warmup)
+        for scenario in SCENARIOS
+        if names is None or scenario.name in names
+    }
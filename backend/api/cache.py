@@ -0,0 +1,82 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+
+def _version_key(scope):
+    return f'api:version:{scope}'
+
+
+def _new_version():
+    # Если ключ версии вытеснен из кеша, новая версия не должна
+    # совпасть со старой, иначе оживут устаревшие записи.
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), timeout=None)
+
+
+def invalidate(namespace, pk=None, shared=False):
+    """Сбрасывает списки namespace и детальную страницу pk,
+    shared=True - все детальные страницы."""
+    scopes = [namespace]
+    if pk is not None:
+        scopes.append(f'{namespace}:{pk}')
+    if shared:
+        scopes.append(f'{namespace}:shared')
+    bump_versions(*scopes)
+
+
+class AnonymousCacheMixin:
+    """Кеширует list и retrieve для анонимов: их флаги всегда False."""
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, [self.cache_namespace],
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_cached_response(
+            request,
+            [f'{self.cache_namespace}:shared', f'{self.cache_namespace}:{pk}'],
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, request, scopes, method, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return method(*args, **kwargs)
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        # В ответах абсолютные ссылки, они зависят от хоста и схемы
+        digest = hashlib.md5(
+            f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+            .encode()).hexdigest()
+        versions = '.'.join(str(version) for version in get_versions(*scopes))
+        key = f'api:{self.cache_namespace}:{versions}:{digest}'
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = method(*args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.API_CACHE_TIMEOUT)
+        return response
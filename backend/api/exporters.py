@@ -0,0 +1,73 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 500
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter(ABC):
+    content_type = None
+    extension = None
+
+    @abstractmethod
+    def lines(self, rows):
+        """Строки файла для строк списка покупок."""
+
+    def response(self, rows, filename='product_list'):
+        response = StreamingHttpResponse(self.lines(rows),
+                                         content_type=self.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}.{self.extension}"')
+        return response
+
+
+class CSVExporter(ShoppingListExporter):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def lines(self, rows):
+        writer = csv.writer(Echo())
+        for row in rows:
+            yield writer.writerow([row['name'], row['amount'],
+                                   row['measurement_unit']])
+
+
+class TextExporter(ShoppingListExporter):
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def lines(self, rows):
+        yield 'Список покупок\n\n'
+        for row in rows:
+            yield (f'{row["name"]} ({row["measurement_unit"]}) '
+                   f'— {row["amount"]}\n')
+
+
+class JSONLinesExporter(ShoppingListExporter):
+    content_type = 'application/x-ndjson'
+    extension = 'jsonl'
+
+    def lines(self, rows):
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (CSVExporter, TextExporter, JSONLinesExporter)
+}
+
+
+def stream_shopping_list(queryset, export_format):
+    """Отдает строки списка покупок по мере чтения из курсора."""
+    exporter = EXPORTERS[export_format]()
+    return exporter.response(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE))
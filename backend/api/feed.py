@@ -0,0 +1,137 @@
+import heapq
+
+from django.conf import settings
+from django.db.models import Q
+from jobs.queue import enqueue
+from reviews.models import Recipe, Subscription, TimelineEntry, User
+
+FAN_OUT_BATCH_SIZE = 1000
+
+
+def is_popular(author):
+    return author.subscribers_count > settings.FEED_FANOUT_MAX_SUBSCRIBERS
+
+
+def fan_out_recipe(recipe_id):
+    """Кладет новый рецепт в ленты подписчиков, кроме популярных авторов."""
+    recipe = Recipe.objects.select_related('author').filter(
+        id=recipe_id).first()
+    if recipe is None or is_popular(recipe.author):
+        return
+    subscribers = Subscription.objects.filter(
+        subscribed_id=recipe.author_id).values_list('subscriber_id',
+                                                    flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                       pub_date=recipe.pub_date)
+         for user_id in subscribers.iterator(chunk_size=FAN_OUT_BATCH_SIZE)),
+        batch_size=FAN_OUT_BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill_timeline(user_id, author_id):
+    """Фоновая задача: последние рецепты автора в ленту нового подписчика."""
+    author = User.objects.filter(id=author_id).only(
+        'subscribers_count').first()
+    if author is None or is_popular(author):
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')[
+        :settings.FEED_BACKFILL_RECIPES]
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                       pub_date=pub_date)
+         for recipe_id, pub_date in recipes),
+        ignore_conflicts=True)
+
+
+def fill_author_timelines(author_id):
+    """Кладет последние рецепты автора в ленты всех подписчиков."""
+    author = User.objects.filter(id=author_id).only(
+        'subscribers_count').first()
+    if author is None or is_popular(author):
+        return 0
+    recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')[
+        :settings.FEED_BACKFILL_RECIPES])
+    subscribers = Subscription.objects.filter(
+        subscribed_id=author_id).values_list('subscriber_id', flat=True)
+    batch = []
+    total = 0
+    for user_id in subscribers.iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.extend(TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                                   pub_date=pub_date)
+                     for recipe_id, pub_date in recipes)
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    return total + len(batch)
+
+
+def fill_demoted_authors(author_ids):
+    """Раскладывает по лентам рецепты авторов, которые после отписки
+    перестали быть популярными."""
+    demoted = User.objects.filter(
+        id__in=author_ids,
+        subscribers_count=settings.FEED_FANOUT_MAX_SUBSCRIBERS,
+    ).values_list('id', flat=True)
+    for author_id in demoted:
+        enqueue(fill_author_timelines, author_id)
+
+
+def remove_from_timeline(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, recipe__author_id=author_id).delete()
+
+
+def _after(position, date_field, id_field):
+    """Строго после позиции (pub_date, id) при сортировке по убыванию."""
+    pub_date, pk = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(
+        **{date_field: pub_date, f'{id_field}__lt': pk})
+
+
+class Feed:
+    """Лента подписок: TimelineEntry обычных авторов, слитые с рецептами
+    популярных."""
+    model = Recipe
+    ordering = ('-pub_date', '-id')
+
+    def __init__(self, user, queryset):
+        self.user = user
+        self.queryset = queryset
+
+    def pushed(self, position, limit):
+        entries = TimelineEntry.objects.filter(user=self.user)
+        if position is not None:
+            entries = entries.filter(_after(position, 'pub_date', 'recipe'))
+        return entries.order_by('-pub_date', '-recipe').values_list(
+            'pub_date', 'recipe_id')[:limit]
+
+    def pulled(self, position, limit):
+        popular = Subscription.objects.filter(
+            subscriber=self.user,
+            subscribed__subscribers_count__gt=(
+                settings.FEED_FANOUT_MAX_SUBSCRIBERS),
+        ).values('subscribed_id')
+        recipes = Recipe.objects.filter(author__in=popular)
+        if position is not None:
+            recipes = recipes.filter(_after(position, 'pub_date', 'id'))
+        return recipes.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id')[:limit]
+
+    def page(self, position, limit):
+        """До limit рецептов строго после position."""
+        merged = heapq.merge(self.pushed(position, limit),
+                             self.pulled(position, limit), reverse=True)
+        recipe_ids = []
+        for _, recipe_id in merged:
+            # Рецепт автора, ставшего популярным, есть в обоих потоках
+            if recipe_ids and recipe_ids[-1] == recipe_id:
+                continue
+            recipe_ids.append(recipe_id)
+            if len(recipe_ids) == limit:
+                break
+        recipes = self.queryset.in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids if pk in recipes]
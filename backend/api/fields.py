@@ -1,13 +1,91 @@
 import base64
+import binascii
+import hashlib
+import warnings
+from io import BytesIO
 
+from django.conf import settings
 from django.core.files.base import ContentFile
+from PIL import Image, UnidentifiedImageError
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в base64, файл называется по sha256 содержимого."""
+    default_error_messages = {
+        'too_large': 'Изображение больше {max_bytes} байт.',
+        'too_many_pixels': 'Изображение больше {max_pixels} пикселей.',
+    }
+
+    def get_model_field(self):
+        return self.parent.Meta.model._meta.get_field(self.source)
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
+        if not (isinstance(data, str) and data.startswith('data:image')):
+            return super().to_internal_value(data)
+        try:
             format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        except ValueError:
+            self.fail('invalid_image')
+        ext = format.split('/')[-1]
+        if len(imgstr) * 3 // 4 > settings.IMAGE_MAX_BYTES:
+            self.fail('too_large', max_bytes=settings.IMAGE_MAX_BYTES)
+        try:
+            content = base64.b64decode(imgstr)
+            # Заголовок с огромными размерами: Pillow предупреждает
+            # или бросает DecompressionBombError еще в Image.open
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', Image.DecompressionBombWarning)
+                with Image.open(BytesIO(content)) as image:
+                    width, height = image.size
+        except (Image.DecompressionBombError,
+                Image.DecompressionBombWarning):
+            self.fail('too_many_pixels',
+                      max_pixels=settings.IMAGE_MAX_PIXELS)
+        except (binascii.Error, ValueError, UnidentifiedImageError):
+            self.fail('invalid_image')
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.IMAGE_MAX_PIXELS)
+        model_field = self.get_model_field()
+        filename = f'{hashlib.sha256(content).hexdigest()}.{ext}'
+        name = model_field.generate_filename(None, filename)
+        if model_field.storage.exists(name):
+            return name
+        return super().to_internal_value(ContentFile(content, name=filename))
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, который проверяется одним запросом IN."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        relation = self.child_relation
+        pks = []
+        for item in data:
+            if isinstance(item, bool):
+                relation.fail('incorrect_type', data_type=type(item).__name__)
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                relation.fail('incorrect_type', data_type=type(item).__name__)
+        objects = relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                relation.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
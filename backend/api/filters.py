@@ -1,33 +1,164 @@
 import django_filters
+from django import forms
+from django.db.models import (Exists, F, OuterRef, Prefetch, Window,
+                              prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django_filters.widgets import BooleanWidget
 from rest_framework.filters import SearchFilter
-from reviews.models import Cart, Favorite, Recipe
+from reviews.models import (Cart, Favorite, IngredientsInRecipe, Recipe,
+                            RecipeTag, Subscription, User)
+
+from .search import search_recipes
 
 
 class SearchFilterNameParam(SearchFilter):
     search_param = "name"
 
 
-def get_filter_recipe_queryset(self):
-    queryset = Recipe.objects.all()
-    user = self.request.user
-    is_favorited = self.request.GET.get('is_favorited')
-    is_in_shopping_cart = self.request.GET.get('is_in_shopping_cart')
-    if is_favorited and user.is_authenticated:
-        objs = Favorite.objects.filter(user=user)
-        recipe_ids = objs.values_list('recipe_id', flat=True)
-        queryset = queryset.filter(id__in=recipe_ids)
-    if is_in_shopping_cart and user.is_authenticated:
-        objs = Cart.objects.filter(user=user)
-        recipe_ids = objs.values_list('recipe_id', flat=True)
-        queryset = queryset.filter(id__in=recipe_ids)
-    tag_ids = self.request.query_params.getlist('tags')
-    if tag_ids:
-        queryset = queryset.filter(tags__slug__in=tag_ids).distinct()
-    return queryset
+def get_read_recipe_queryset(user):
+    """Рецепты со связями и флагами пользователя для ReadRecipeSerializer."""
+    authors = User.objects.all()
+    queryset = Recipe.objects.defer('search_vector').prefetch_related(
+        'tags',
+        Prefetch('ingredientsinrecipes',
+                 queryset=IngredientsInRecipe.objects.select_related(
+                     'ingredient').order_by('ingredient__name')),
+    )
+    if user.is_authenticated:
+        authors = authors.annotate(is_subscribed=Exists(
+            Subscription.objects.filter(subscriber=user,
+                                        subscribed=OuterRef('pk'))))
+        queryset = queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(Cart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+    return queryset.prefetch_related(Prefetch('author', queryset=authors))
+
+
+def get_subscribed_authors_queryset(user):
+    """Авторы, на которых подписан user."""
+    return User.objects.filter(subscribers__subscriber=user)
+
+
+def prefetch_recipe_previews(authors, recipes_limit=None):
+    """Кладет в author.preview_recipes последние recipes_limit рецептов."""
+    recipes = Recipe.objects.order_by('-pub_date', '-id')
+    if recipes_limit:
+        ranked = Recipe.objects.filter(
+            author__in=[author.id for author in authors]
+        ).annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author_id')],
+            order_by=[F('pub_date').desc(), F('id').desc()],
+        )).order_by().values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        recipes = recipes.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, recipes_limit)))
+    prefetch_related_objects(
+        authors,
+        Prefetch('recipes', queryset=recipes, to_attr='preview_recipes'))
+    return authors
+
+
+# ?ordering= списка рецептов: порядок для order_by и курсора
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-popular_score', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+
+
+def get_recipe_ordering(request):
+    """Порядок курсора; None при поиске - там порядок по релевансу,
+    и курсор не используется."""
+    if request.query_params.get('search', '').strip():
+        return None
+    return RECIPE_ORDERINGS.get(
+        request.query_params.get('ordering'), RECIPE_ORDERINGS['new'])
+
+
+class MultipleValueField(forms.Field):
+    """Повторяющийся параметр (?tags=a&tags=b) как список значений."""
+    widget = forms.MultipleHiddenInput
+
+    def __init__(self, *args, coerce=str, **kwargs):
+        self.coerce = coerce
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        try:
+            return [self.coerce(item) for item in value or [] if item]
+        except (TypeError, ValueError):
+            raise forms.ValidationError('Неверное значение')
+
+
+class MultipleValueFilter(django_filters.Filter):
+    field_class = MultipleValueField
 
 
 class RecipeFilter(django_filters.FilterSet):
+    """Фильтры списка рецептов; связи проверяются через EXISTS."""
+    author = django_filters.NumberFilter(field_name='author')
+    tags = MultipleValueFilter(method='filter_tags')
+    ingredients = MultipleValueFilter(method='filter_ingredients',
+                                      coerce=int)
+    min_cooking_time = django_filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='gte')
+    max_cooking_time = django_filters.NumberFilter(
+        field_name='cooking_time', lookup_expr='lte')
+    search = django_filters.CharFilter(method='filter_search')
+    is_favorited = django_filters.BooleanFilter(
+        method='filter_user_set', widget=BooleanWidget())
+    is_in_shopping_cart = django_filters.BooleanFilter(
+        method='filter_user_set', widget=BooleanWidget())
+    ordering = django_filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering')
+
+    user_sets = {
+        'is_favorited': Favorite,
+        'is_in_shopping_cart': Cart,
+    }
 
     class Meta:
         model = Recipe
         fields = ['author', ]
+
+    def filter_tags(self, queryset, name, slugs):
+        """Рецепты хотя бы с одним из тегов."""
+        if not slugs:
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=slugs)))
+
+    def filter_ingredients(self, queryset, name, ingredient_ids):
+        """Рецепты, в которых есть все перечисленные ингредиенты."""
+        for ingredient_id in set(ingredient_ids):
+            queryset = queryset.filter(Exists(
+                IngredientsInRecipe.objects.filter(
+                    recipe=OuterRef('pk'), ingredient_id=ingredient_id)))
+        return queryset
+
+    def filter_search(self, queryset, name, text):
+        if not text.strip():
+            return queryset
+        return search_recipes(queryset, text)
+
+    def filter_ordering(self, queryset, name, value):
+        """Каждому порядку соответствует индекс (поле, -id)."""
+        if self.data.get('search', '').strip():
+            return queryset
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
+    def filter_user_set(self, queryset, name, value):
+        user = self.request.user
+        if value is None or not user.is_authenticated:
+            return queryset
+        in_set = Exists(self.user_sets[name].objects.filter(
+            user=user, recipe=OuterRef('pk')))
+        return queryset.filter(in_set if value else ~in_set)
@@ -0,0 +1,74 @@
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+from reviews.models import Recipe
+
+from .cache import invalidate
+
+# имя размера: максимальные ширина и высота
+THUMBNAIL_SIZES = {
+    'list': (480, 480),
+    'detail': (1200, 1200),
+}
+# расширение: (формат Pillow, параметры сохранения)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True}),
+}
+
+
+def thumbnail_name(image_name, size, extension):
+    directory, filename = posixpath.split(image_name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'thumbs', f'{stem}_{size}.{extension}')
+
+
+def generate_thumbnails(image_name, content=None, storage=default_storage):
+    """Создает миниатюры list и detail в WebP и JPEG."""
+    if content is None:
+        with storage.open(image_name, 'rb') as file:
+            content = file.read()
+    with Image.open(BytesIO(content)) as original:
+        original.load()
+        for size, bounds in THUMBNAIL_SIZES.items():
+            image = original.copy()
+            image.thumbnail(bounds)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            for extension, (image_format, options) in (
+                THUMBNAIL_FORMATS.items()
+            ):
+                name = thumbnail_name(image_name, size, extension)
+                if storage.exists(name):
+                    continue
+                converted = image
+                if image_format == 'JPEG' and image.mode != 'RGB':
+                    converted = image.convert('RGB')
+                buffer = BytesIO()
+                converted.save(buffer, image_format, **options)
+                storage.save(name, ContentFile(buffer.getvalue()))
+    recipes = Recipe.objects.filter(image=image_name)
+    recipe_ids = list(recipes.values_list('id', flat=True))
+    recipes.update(has_thumbnails=True)
+    # В кеше анонимов остались ответы с thumbnails: null
+    for pk in recipe_ids:
+        invalidate('recipes', pk)
+
+
+def thumbnail_urls(recipe, request=None, storage=default_storage):
+    """Ссылки на миниатюры или None, если они еще не созданы."""
+    image = recipe.image
+    if not image or not recipe.has_thumbnails:
+        return None
+    urls = {}
+    for size in THUMBNAIL_SIZES:
+        urls[size] = {}
+        for extension in THUMBNAIL_FORMATS:
+            url = storage.url(thumbnail_name(image.name, size, extension))
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[size][extension] = url
+    return urls
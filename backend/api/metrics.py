@@ -0,0 +1,149 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Границы корзин гистограмм, как у клиентов Prometheus по умолчанию
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+METRICS = {
+    'request_seconds': ('Время обработки запроса', SECONDS_BUCKETS),
+    'db_seconds': ('Время запросов к базе', SECONDS_BUCKETS),
+    'serialize_seconds': ('Время вью без базы (в основном сериализация)',
+                          SECONDS_BUCKETS),
+    'render_seconds': ('Время рендеринга ответа', SECONDS_BUCKETS),
+    'db_queries': ('Число запросов к базе', QUERIES_BUCKETS),
+}
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Гистограммы метрик по вью в памяти процесса."""
+    prefix = 'foodgram_'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view, values):
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(
+                        METRICS[name][1])
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """Гистограммы в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in METRICS.items():
+                metric = f'{self.prefix}{name}'
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (key, view), histogram in sorted(
+                        self._histograms.items()):
+                    if key != name:
+                        continue
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{view="{view}",'
+                                     f'le="{bound}"}} {total}')
+                    lines.append(f'{metric}_sum{{view="{view}"}} '
+                                 f'{histogram.sum}')
+                    lines.append(f'{metric}_count{{view="{view}"}} '
+                                 f'{histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestTimings:
+    """Время и число SQL-запросов одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.render_started = None
+        self.render_finished = None
+        self.finished = None
+        self.queries = 0
+        self.db_time = 0
+        self.view_db_time = 0
+        self.render_db_time = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    def start_view(self):
+        self.view_started = time.perf_counter()
+        self.view_db_time = self.db_time
+
+    def start_render(self):
+        self.render_started = time.perf_counter()
+        self.render_db_time = self.db_time
+
+    def finish_render(self, response=None):
+        self.render_finished = time.perf_counter()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def get_values(self):
+        view_finished = self.render_started or self.finished
+        view_db_time = (self.db_time if self.render_db_time is None
+                        else self.render_db_time) - self.view_db_time
+        serialize = 0
+        if self.view_started is not None:
+            serialize = max(
+                view_finished - self.view_started - view_db_time, 0)
+        render = 0
+        if self.render_started is not None:
+            render = (self.render_finished or self.finished) - (
+                self.render_started)
+        return {
+            'request_seconds': self.finished - self.started,
+            'db_seconds': self.db_time,
+            'serialize_seconds': serialize,
+            'render_seconds': render,
+            'db_queries': self.queries,
+        }
+
+    def server_timing(self, values):
+        return ', '.join((
+            f'db;dur={values["db_seconds"] * 1000:.1f};'
+            f'desc="{values["db_queries"]} queries"',
+            f'serialize;dur={values["serialize_seconds"] * 1000:.1f}',
+            f'render;dur={values["render_seconds"] * 1000:.1f}',
+            f'total;dur={values["request_seconds"] * 1000:.1f}',
+        ))
@@ -0,0 +1,38 @@
+import random
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import RequestTimings, registry
+
+
+class MetricsMiddleware:
+    """Server-Timing и гистограммы для доли METRICS_SAMPLE_RATE запросов."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        timings = request.metrics_timings = RequestTimings()
+        with connection.execute_wrapper(timings):
+            response = self.get_response(request)
+        timings.finish()
+        values = timings.get_values()
+        match = request.resolver_match
+        registry.observe(match.view_name if match else 'not_found', values)
+        response['Server-Timing'] = timings.server_timing(values)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = getattr(request, 'metrics_timings', None)
+        if timings is not None:
+            timings.start_view()
+
+    def process_template_response(self, request, response):
+        timings = getattr(request, 'metrics_timings', None)
+        if timings is not None:
+            timings.start_render()
+            response.add_post_render_callback(timings.finish_render)
+        return response
@@ -0,0 +1,17 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class CSVRenderer(JSONRenderer):
+    """Рендерер для согласования ?format=, сам файл отдается потоком."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class TextRenderer(JSONRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class JSONLinesRenderer(JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
@@ -0,0 +1,241 @@
+import io
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db.models import Q
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+from reviews.models import User
+
+from .benchmarks import PERCENTILES, percentile
+
+
+class LogEntry:
+    """Запрос из журнала JSON Lines."""
+
+    def __init__(self, method, path, query, body, user, moment):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.user = user
+        self.moment = moment
+
+    @classmethod
+    def parse(cls, line):
+        """LogEntry или None, если строка - не HTTP-запрос."""
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        path = data.get('path')
+        if not isinstance(path, str) or not path.startswith('/'):
+            return None
+        path, _, query = path.partition('?')
+        query = data.get('query') or query
+        if isinstance(query, dict):
+            query = urlencode(query, doseq=True)
+        body = data.get('body')
+        if body is None:
+            body = b''
+        elif isinstance(body, str):
+            body = body.encode()
+        else:
+            body = json.dumps(body).encode()
+        return cls(str(data.get('method') or 'GET').upper(), path, query,
+                   body, data.get('user'), parse_time(data.get('time')))
+
+
+def parse_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(
+                value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def get_route(method, path):
+    """Маршрут для группировки: метод и имя URL, как в /metrics."""
+    try:
+        view_name = resolve(path).view_name
+    except Resolver404:
+        view_name = 'not_found'
+    return f'{method} {view_name}'
+
+
+def get_tokens(users):
+    """Ключи токенов пользователей журнала и ключи созданных для прогона."""
+    ids = {user for user in users if isinstance(user, int)}
+    names = {user for user in users if isinstance(user, str)}
+    tokens = {}
+    created = []
+    for user in User.objects.filter(
+            Q(id__in=ids) | Q(email__in=names) | Q(username__in=names)
+    ).select_related('auth_token'):
+        try:
+            key = user.auth_token.key
+        except Token.DoesNotExist:
+            key = Token.objects.create(user=user).key
+            created.append(key)
+        for alias in (user.id, user.email, user.username):
+            if alias in users:
+                tokens[alias] = key
+    return tokens, created
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.timings = []
+        self.statuses = Counter()
+
+    def add(self, status, spent):
+        self.timings.append(spent * 1000)
+        self.statuses[status] += 1
+
+    def summary(self):
+        count = len(self.timings)
+        errors = sum(number for status, number in self.statuses.items()
+                     if status >= 400)
+        result = {f'p{percent}_ms': round(percentile(self.timings, percent),
+                                          3)
+                  for percent in PERCENTILES}
+        result.update({
+            'requests': count,
+            'max_ms': round(max(self.timings), 3),
+            'error_rate': round(errors / count, 4),
+            'statuses': {str(status): number for status, number
+                         in sorted(self.statuses.items())},
+        })
+        return result
+
+
+class TrafficReplay:
+    """Воспроизводит журнал через WSGI-приложение из пула потоков."""
+
+    def __init__(self, entries, concurrency=4, speedup=1.0, writes=False):
+        self.entries = entries
+        self.concurrency = concurrency
+        self.speedup = speedup
+        self.writes = writes
+        self.handler = WSGIHandler()
+        self.tokens = {}
+        self.routes = defaultdict(RouteStats)
+        self.lags = []
+        self.unknown_users = 0
+        self.skipped_writes = 0
+        self._lock = threading.Lock()
+
+    def get_environ(self, entry, token):
+        environ = {
+            'REQUEST_METHOD': entry.method,
+            'PATH_INFO': entry.path,
+            'QUERY_STRING': entry.query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(entry.body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(entry.body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if token is not None:
+            environ['HTTP_AUTHORIZATION'] = f'Token {token}'
+        return environ
+
+    def send(self, entry, token, scheduled):
+        started = time.perf_counter()
+        statuses = []
+        response = self.handler(
+            self.get_environ(entry, token),
+            lambda status, headers: statuses.append(int(status[:3])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        spent = time.perf_counter() - started
+        with self._lock:
+            self.routes[get_route(entry.method, entry.path)].add(
+                statuses[0], spent)
+            self.lags.append(max(started - scheduled, 0) * 1000)
+
+    def get_offsets(self):
+        """Секунды от начала воспроизведения для каждого запроса."""
+        first = next((entry.moment for entry in self.entries
+                      if entry.moment is not None), None)
+        offset = 0
+        for entry in self.entries:
+            if self.speedup and first is not None and (
+                    entry.moment is not None):
+                offset = max((entry.moment - first) / self.speedup, offset)
+            yield offset
+
+    def run(self):
+        self.tokens, created = get_tokens({
+            entry.user for entry in self.entries if entry.user is not None})
+        try:
+            return self.send_all()
+        finally:
+            Token.objects.filter(key__in=created).delete()
+
+    def send_all(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = []
+            for entry, offset in zip(self.entries, self.get_offsets()):
+                if not self.writes and entry.method not in SAFE_METHODS:
+                    self.skipped_writes += 1
+                    continue
+                token = None
+                if entry.user is not None:
+                    token = self.tokens.get(entry.user)
+                    if token is None:
+                        self.unknown_users += 1
+                        continue
+                scheduled = started + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(
+                    executor.submit(self.send, entry, token, scheduled))
+            for future in futures:
+                future.result()
+        return time.perf_counter() - started
+
+    def report(self, duration):
+        total = sum(len(stats.timings) for stats in self.routes.values())
+        return {
+            'requests': total,
+            'unknown_users': self.unknown_users,
+            'skipped_writes': self.skipped_writes,
+            'duration_s': round(duration, 3),
+            'rps': round(total / duration, 1) if duration else 0,
+            'lag_p95_ms': (round(percentile(self.lags, 95), 3)
+                           if self.lags else 0),
+            'routes': {
+                route: stats.summary() for route, stats in sorted(
+                    self.routes.items(),
+                    key=lambda item: -len(item[1].timings))
+            },
+        }
@@ -0,0 +1,222 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from reviews.models import IndexVersion, Ingredient, IngredientsInRecipe
+
+
+def get_version(name):
+    return IndexVersion.objects.filter(name=name).values_list(
+        'value', flat=True).first() or 0
+
+
+def bump_version(name):
+    """Увеличивает версию индекса name и возвращает новую."""
+    versions = IndexVersion.objects.filter(name=name)
+    if not versions.update(value=F('value') + 1):
+        _, created = IndexVersion.objects.get_or_create(
+            name=name, defaults={'value': 1})
+        if not created:
+            versions.update(value=F('value') + 1)
+    return get_version(name)
+
+
+class VersionedIndex:
+    """Индекс в памяти, который перечитывается при смене версии в базе."""
+    version_name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+
+    def _get_version(self):
+        """Версия в базе или None, если проверять еще рано."""
+        now = time.monotonic()
+        if self._version is not None and (
+                now - self._checked < settings.INDEX_RECHECK_SECONDS):
+            return None
+        self._checked = now
+        return get_version(self.version_name)
+
+
+class IngredientPrefixIndex(VersionedIndex):
+    """Отсортированный в памяти список ингредиентов для автодополнения."""
+    version_name = 'ingredients'
+
+    def __init__(self):
+        super().__init__()
+        self._index = ([], [])
+
+    def invalidate(self):
+        bump_version(self.version_name)
+        self._version = None
+
+    def _load(self, version):
+        entries = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda entry: (entry['name'].casefold(), entry['name']))
+        # Одним присваиванием: search без блокировки не должен увидеть
+        # новые ключи со старыми записями
+        self._index = ([entry['name'].casefold() for entry in entries],
+                       entries)
+        self._version = version
+
+    def _ensure_loaded(self):
+        version = self._get_version()
+        if version is None or self._version == version:
+            return
+        with self._lock:
+            if self._version != version:
+                self._load(version)
+
+    def search(self, prefix=''):
+        self._ensure_loaded()
+        keys, entries = self._index
+        prefix = prefix.strip().casefold()
+        if not prefix:
+            return list(entries)
+        start = position = bisect_left(keys, prefix)
+        while position < len(keys) and keys[position].startswith(prefix):
+            position += 1
+        return entries[start:position]
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+class RecipeIngredientIndex(VersionedIndex):
+    """Инвертированный индекс ингредиент -> рецепты для "что приготовить"."""
+    version_name = 'recipe_ingredients'
+    # Списки измененных рецептов по версиям; если их нет в кеше,
+    # индекс строится заново
+    changes_key = 'recipes:ingredients:changes:{}'
+    max_changes = 100
+    changes_timeout = 60 * 60 * 24
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._recipes = {}
+
+    def invalidate(self, recipe_ids=None):
+        """Сообщает об изменении рецептов, None - перестроить целиком."""
+        version = bump_version(self.version_name)
+        if recipe_ids is not None:
+            cache.set(self.changes_key.format(version), list(recipe_ids),
+                      timeout=self.changes_timeout)
+        self._checked = 0
+
+    def _load(self, version):
+        postings = {}
+        recipes = {}
+        rows = IngredientsInRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id').values_list(
+            'ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator(chunk_size=10000):
+            postings.setdefault(ingredient_id, array('q')).append(recipe_id)
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        self._postings = postings
+        self._recipes = {recipe_id: frozenset(ingredients)
+                         for recipe_id, ingredients in recipes.items()}
+        self._version = version
+
+    def _get_changes(self, version):
+        """Рецепты, измененные после загруженной версии, или None."""
+        if self._version is None or version < self._version or (
+                version - self._version > self.max_changes):
+            return None
+        keys = [self.changes_key.format(number)
+                for number in range(self._version + 1, version + 1)]
+        found = cache.get_many(keys)
+        if len(found) != len(keys):
+            return None
+        return {recipe_id for recipe_ids in found.values()
+                for recipe_id in recipe_ids}
+
+    def _apply(self, recipe_ids, version):
+        current = {recipe_id: set() for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in IngredientsInRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            current[recipe_id].add(ingredient_id)
+        touched = {}
+        for recipe_id, ingredients in current.items():
+            old = self._recipes.get(recipe_id, frozenset())
+            for ingredient_id in old - ingredients:
+                touched.setdefault(ingredient_id, {})[recipe_id] = False
+            for ingredient_id in ingredients - old:
+                touched.setdefault(ingredient_id, {})[recipe_id] = True
+            if ingredients:
+                self._recipes[recipe_id] = frozenset(ingredients)
+            else:
+                self._recipes.pop(recipe_id, None)
+        for ingredient_id, changes in touched.items():
+            # Новый array вместо правки на месте: читатели без блокировки
+            # видят либо старый, либо новый список целиком
+            recipes = set(self._postings.get(ingredient_id, ()))
+            recipes.difference_update(
+                recipe_id for recipe_id, added in changes.items()
+                if not added)
+            recipes.update(
+                recipe_id for recipe_id, added in changes.items() if added)
+            self._postings[ingredient_id] = array('q', sorted(recipes))
+        self._version = version
+
+    def _ensure_loaded(self):
+        version = self._get_version()
+        if version is None or self._version == version:
+            return
+        with self._lock:
+            if self._version == version:
+                return
+            changes = self._get_changes(version)
+            if changes is None:
+                self._load(version)
+            else:
+                self._apply(changes, version)
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """До limit пар (recipe_id, missing) по возрастанию missing."""
+        self._ensure_loaded()
+        postings = self._postings
+        recipes = self._recipes
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, ()))
+        ranked = (
+            (len(recipes.get(recipe_id, ())) - count, -count, -recipe_id)
+            for recipe_id, count in matched.items()
+        )
+        if max_missing is not None:
+            ranked = (item for item in ranked if item[0] <= max_missing)
+        return [(-recipe_id, missing) for missing, _, recipe_id
+                in heapq.nsmallest(limit, ranked)]
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+def search_recipes(queryset, text):
+    """Рецепты по поисковой строке, по убыванию релевантности."""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query),
+        ).order_by('-rank', '-pub_date', '-id')
+    words = text.split()
+    rank = Value(0)
+    for word in words:
+        queryset = queryset.filter(
+            Q(name__icontains=word) | Q(text__icontains=word))
+        rank += Case(When(name__icontains=word, then=Value(2)),
+                     default=Value(1), output_field=IntegerField())
+    return queryset.annotate(rank=rank).order_by('-rank', '-pub_date', '-id')
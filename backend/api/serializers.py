@@ -1,19 +1,25 @@
-import csv
-import random
-import string
-
 from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
-from django.db.models import F
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import F, Sum
+from jobs.queue import enqueue
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.validators import UniqueValidator
+from reviews.counters import change_counter
 from reviews.models import (Cart, Favorite, Ingredient, IngredientsInRecipe,
-                            Recipe, ShortLinkRecipe, Subscription, Tag, User)
+                            Recipe, RecipeTag, ShortLinkRecipe, Subscription,
+                            Tag, User)
 
-from .fields import Base64ImageField
+from .exporters import stream_shopping_list
+from .feed import backfill_timeline, fan_out_recipe
+from .fields import Base64ImageField, BulkPrimaryKeyRelatedField
+from .filters import get_read_recipe_queryset
+from .images import generate_thumbnails, thumbnail_urls
+from .shortlinks import get_or_create_short_link
+from .similarity import update_recipe_signature
+from .viewer import get_viewer
 
 
 class CreateUserSerializer(serializers.ModelSerializer):
@@ -66,8 +72,7 @@ class UserSerializer(CreateUserSerializer):
         if request.method in SAFE_METHODS and (
             request.user.is_authenticated
         ):
-            return Subscription.objects.filter(subscriber=request.user,
-                                               subscribed=obj).exists()
+            return get_viewer(request).is_subscribed(obj)
         return False
 
 
@@ -114,6 +119,7 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     image = Base64ImageField()
+    thumbnails = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -123,30 +129,62 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author',
             'ingredients', 'is_favorited',
             'is_in_shopping_cart',
-            'name', 'image', 'text',
+            'name', 'image', 'thumbnails', 'text',
             'cooking_time',
         )
 
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+
     def get_ingredients(self, obj):
-        ingredients = obj.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('ingredientsinrecipes__amount')
-        )
-        return ingredients
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredientsinrecipes.all()
+        ]
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated) and (
-            user.favorites.filter(recipe=obj).exists()
-        )
+        return get_viewer(self.context.get('request')).is_favorited(obj)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated) and (
-            user.carts.filter(recipe=obj).exists()
-        )
+        return get_viewer(
+            self.context.get('request')).is_in_shopping_cart(obj)
+
+
+class LimitQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=6)
+
+
+class CookableQuerySerializer(LimitQuerySerializer):
+    """Параметры ?ingredients=&max_missing=&limit= для what-can-i-cook."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class CookableRecipeSerializer(ReadRecipeSerializer):
+    missing_count = serializers.SerializerMethodField()
+
+    class Meta(ReadRecipeSerializer.Meta):
+        fields = ReadRecipeSerializer.Meta.fields + ('missing_count',)
+
+    def get_missing_count(self, obj):
+        return self.context['missing'][obj.id]
+
+
+class SimilarRecipeSerializer(ReadRecipeSerializer):
+    similarity = serializers.SerializerMethodField()
+
+    class Meta(ReadRecipeSerializer.Meta):
+        fields = ReadRecipeSerializer.Meta.fields + ('similarity',)
+
+    def get_similarity(self, obj):
+        return round(self.context['similarity'][obj.id], 3)
 
 
 class WriteIngredientsInRecipeSerializer(serializers.ModelSerializer):
@@ -157,13 +195,6 @@ class WriteIngredientsInRecipeSerializer(serializers.ModelSerializer):
         model = IngredientsInRecipe
         fields = ('id', 'amount')
 
-    def validate_id(self, value):
-        if not Ingredient.objects.filter(id=value).exists():
-            raise ValidationError({
-                'ingredients': 'Ингредиент не существует'
-            })
-        return value
-
     def validate_amount(self, value):
         if value < 1:
             raise ValidationError({
@@ -173,8 +204,8 @@ class WriteIngredientsInRecipeSerializer(serializers.ModelSerializer):
 
 
 class WriteRecipeSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(many=True,
+                                      queryset=Tag.objects.all())
     ingredients = WriteIngredientsInRecipeSerializer(many=True)
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
@@ -221,6 +252,12 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
             raise ValidationError({
                 'ingredients': 'Ингредиенты не должны повторяться'
             })
+        existing = set(Ingredient.objects.filter(
+            id__in=set_of_ing).values_list('id', flat=True))
+        if existing != set(set_of_ing):
+            raise ValidationError({
+                'ingredients': 'Ингредиент не существует'
+            })
         return value
 
     def validate_tags(self, value):
@@ -235,44 +272,97 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
         return value
 
     def create_ingredients_amount(self, ingredients, recipe):
-        ingredients_in_recipe = (IngredientsInRecipe(
-            ingredient=Ingredient.objects.get(id=ingredient.get(
-                'ingredient')['id']),
-            recipe=recipe,
-            amount=ingredient['amount']
-        ) for ingredient in ingredients)
         IngredientsInRecipe.objects.bulk_create(
-            ingredients_in_recipe
+            IngredientsInRecipe(
+                ingredient_id=ingredient['ingredient']['id'],
+                recipe=recipe,
+                amount=ingredient['amount']
+            ) for ingredient in ingredients
         )
 
+    def update_ingredients_amount(self, ingredients, recipe):
+        """Меняет только отличающиеся строки IngredientsInRecipe."""
+        current = {
+            item.ingredient_id: item
+            for item in IngredientsInRecipe.objects.filter(recipe=recipe)
+        }
+        amounts = {ingredient['ingredient']['id']: ingredient['amount']
+                   for ingredient in ingredients}
+        removed = [item.id for ingredient_id, item in current.items()
+                   if ingredient_id not in amounts]
+        if removed:
+            IngredientsInRecipe.objects.filter(id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            IngredientsInRecipe.objects.bulk_update(changed, ['amount'])
+        added = [ingredient for ingredient in ingredients
+                 if ingredient['ingredient']['id'] not in current]
+        if added:
+            self.create_ingredients_amount(added, recipe)
+
+    def update_tags(self, tags, recipe):
+        current = set(RecipeTag.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        new = {tag.id for tag in tags}
+        if current - new:
+            RecipeTag.objects.filter(recipe=recipe,
+                                     tag_id__in=current - new).delete()
+        if new - current:
+            RecipeTag.objects.bulk_create(
+                RecipeTag(recipe=recipe, tag_id=tag_id)
+                for tag_id in new - current
+            )
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
+        change_counter('recipes_count', recipe.author_id, 1)
         self.create_ingredients_amount(
             ingredients=ingredients,
             recipe=recipe
         )
-        recipe.tags.set(tags)
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        update_recipe_signature(
+            recipe,
+            [ingredient['ingredient']['id'] for ingredient in ingredients],
+            [tag.id for tag in tags], created=True)
+        enqueue(generate_thumbnails, recipe.image.name)
+        enqueue(fan_out_recipe, recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if self.context.get('request').user != instance.author:
             raise PermissionDenied()
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        if 'image' in validated_data:
+            validated_data['has_thumbnails'] = False
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.ingredients.clear()
-        instance.tags.set(tags)
-        self.create_ingredients_amount(recipe=instance,
+        self.update_tags(tags=tags, recipe=instance)
+        self.update_ingredients_amount(recipe=instance,
                                        ingredients=ingredients)
-        instance.save()
+        update_recipe_signature(
+            instance,
+            [ingredient['ingredient']['id'] for ingredient in ingredients],
+            [tag.id for tag in tags])
+        if 'image' in validated_data:
+            enqueue(generate_thumbnails, instance.image.name)
         return instance
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = get_read_recipe_queryset(request.user).get(pk=instance.pk)
         return ReadRecipeSerializer(instance, context=context).data
 
 
@@ -284,37 +374,30 @@ class ShortLinkRecipeSerializer(serializers.ModelSerializer):
         read_only = ('short_link',)
         write_only_fields = ('full_link', 'recipe')
 
-    def short_link(self):
-        characters = string.ascii_letters + string.digits
-        return ''.join(random.choice(characters) for _ in range(6))
-
     def create(self, validated_data):
-        try:
-            return ShortLinkRecipe.objects.get(
-                recipe_id=validated_data['recipe'].id,
-                full_link=validated_data['full_link'])
-        except ObjectDoesNotExist:
-            return ShortLinkRecipe.objects.create(
-                recipe=validated_data['recipe'],
-                full_link=validated_data['full_link'],
-                short_link=self.short_link())
+        return get_or_create_short_link(validated_data['recipe'],
+                                        validated_data['full_link'])
 
 
 class ReadCartRecipeSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image',
+        fields = ('id', 'name', 'image', 'thumbnails',
                   'cooking_time')
         read_only_fields = ('id', 'name', 'image',
                             'cooking_time')
 
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+
 
 class RecipeForCartSerializer(ReadRecipeSerializer):
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
 
 
 class WriteBaseRecipeSerializer(serializers.ModelSerializer):
@@ -344,6 +427,7 @@ class WriteBaseRecipeSerializer(serializers.ModelSerializer):
                 'errors': 'Данный рецепт уже в списке'
             })
 
+    @transaction.atomic
     def create(self, validated_data):
         user = validated_data.get('user')
         recipe = validated_data.get('recipe')
@@ -351,10 +435,12 @@ class WriteBaseRecipeSerializer(serializers.ModelSerializer):
             user=user,
             recipe=recipe
         )
+        change_counter(self.counter_field, recipe.id, 1)
         return obj
 
 
 class WriteCartRecipeSerializer(WriteBaseRecipeSerializer):
+    counter_field = 'carts_count'
 
     class Meta:
         model = Cart
@@ -362,22 +448,15 @@ class WriteCartRecipeSerializer(WriteBaseRecipeSerializer):
 
 
 class WriteFavoriteRecipeSerializer(WriteBaseRecipeSerializer):
+    counter_field = 'favorites_count'
 
     class Meta:
         model = Favorite
         fields = ('recipe',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
-
-
 class SubscribeToUserSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -388,16 +467,20 @@ class SubscribeToUserSerializer(serializers.ModelSerializer):
                   'avatar')
         read_only_fields = ('email', 'username',
                             'first_name', 'last_name',
-                            'avatar')
+                            'recipes_count', 'avatar')
 
     def get_recipes(self, obj):
-        recipes = obj.recipes.all()
-        serializer = ReadCartRecipeSerializer(recipes, many=True)
+        if hasattr(obj, 'preview_recipes'):
+            recipes = obj.preview_recipes
+        else:
+            recipes = obj.recipes.order_by('-pub_date', '-id')
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:recipes_limit]
+        serializer = ReadCartRecipeSerializer(recipes, many=True,
+                                              context=self.context)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_is_subscribed(self, obj):
         pass
 
@@ -422,10 +505,15 @@ class CreateSubscribeSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
-        return Subscription.objects.create(
+        subscription = Subscription.objects.create(
             subscribed=validated_data['subscribed'],
             subscriber=validated_data['subscriber'])
+        change_counter('subscribers_count', subscription.subscribed_id, 1)
+        enqueue(backfill_timeline, subscription.subscriber_id,
+                subscription.subscribed_id)
+        return subscription
 
 
 class WriteSubscribeToUserSerializer(SubscribeToUserSerializer):
@@ -451,32 +539,15 @@ class ReadSubscribeToUserSerializer(SubscribeToUserSerializer):
 class CreateListCartSerializer(serializers.Serializer):
 
     def get_list(self):
-        data_of_cart_for_user = Cart.objects.filter(
-            user=self.context.get('request').user)
-        data_ing_rec = [IngredientsInRecipe.objects.filter(
-            recipe=obj.recipe) for obj in data_of_cart_for_user]
-        lst_am_ing = []
-        for recipes in data_ing_rec:
-            for obj in recipes:
-                count = False
-                serializer = IngredientSerializer(obj.ingredient)
-                key = serializer.data['name']
-                for d in lst_am_ing:
-                    if d.get('ingredient') == key:
-                        d['amount'] += obj.amount
-                        count = True
-                        break
-                if not count:
-                    lst_am_ing.append(
-                        ({'amount': obj.amount,
-                          'ingredient': serializer.data['name']}))
-        return lst_am_ing
-
-    def download_csv(self):
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = (
-            'attachment; filename="product_list.csv"')
-        writer = csv.writer(response)
-        for product in self.get_list():
-            writer.writerow([product.get('ingredient'), product.get('amount')])
-        return response
+        """Суммарное количество каждого ингредиента из корзины."""
+        return IngredientsInRecipe.objects.filter(
+            recipe__carts__user=self.context.get('request').user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).annotate(
+            amount=Sum('amount')
+        ).order_by('name', 'measurement_unit')
+
+    def download(self, export_format='csv'):
+        return stream_shopping_list(self.get_list(), export_format)
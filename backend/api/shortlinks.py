@@ -0,0 +1,71 @@
+import hashlib
+import string
+from functools import lru_cache
+
+from django.db import IntegrityError, transaction
+from reviews.models import ShortLinkRecipe
+
+from .cache import bump_versions, get_versions
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+SHORT_LINK_ATTEMPTS = 5
+RESOLVER_CACHE_SIZE = 10000
+
+
+def base62(number):
+    if number == 0:
+        return BASE62_ALPHABET[0]
+    digits = []
+    while number:
+        number, remainder = divmod(number, len(BASE62_ALPHABET))
+        digits.append(BASE62_ALPHABET[remainder])
+    return ''.join(reversed(digits))
+
+
+def make_short_code(recipe_id, attempt=0):
+    """Код короткой ссылки: base62 от id рецепта."""
+    if attempt == 0:
+        return base62(recipe_id)
+    digest = hashlib.blake2b(f'{recipe_id}:{attempt}'.encode(),
+                             digest_size=5).digest()
+    return base62(int.from_bytes(digest, 'big'))
+
+
+def get_or_create_short_link(recipe, full_link):
+    link = ShortLinkRecipe.objects.filter(recipe=recipe,
+                                          full_link=full_link).first()
+    if link is not None:
+        return link
+    for attempt in range(SHORT_LINK_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return ShortLinkRecipe.objects.create(
+                    recipe=recipe, full_link=full_link,
+                    short_link=make_short_code(recipe.id, attempt))
+        except IntegrityError:
+            continue
+    raise IntegrityError(
+        f'Не удалось подобрать короткую ссылку для рецепта {recipe.id}')
+
+
+@lru_cache(maxsize=RESOLVER_CACHE_SIZE)
+def _resolve(short_link):
+    return ShortLinkRecipe.objects.values_list(
+        'full_link', flat=True).get(short_link=short_link)
+
+
+_resolver_version = None
+
+
+def resolve_short_link(short_link):
+    """Полная ссылка по коду, с LRU-кешем процесса перед базой."""
+    global _resolver_version
+    version, = get_versions('short_links')
+    if version != _resolver_version:
+        _resolve.cache_clear()
+        _resolver_version = version
+    return _resolve(short_link)
+
+
+def invalidate_short_links():
+    bump_versions('short_links')
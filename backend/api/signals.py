@@ -0,0 +1,142 @@
+from asgiref.local import Local
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from jobs.queue import enqueue
+from reviews.models import (Ingredient, IngredientsInRecipe, Recipe, RecipeTag,
+                            ShortLinkRecipe, Tag, User)
+from reviews.scores import BATCH_SIZE, recompute_scores
+from reviews.signals import scores_updated
+
+from .cache import invalidate
+from .search import ingredient_index, recipe_ingredient_index
+from .shortlinks import invalidate_short_links
+
+_pending = Local()
+
+
+def on_commit_batch(callback, item):
+    """Вызывает callback(items) один раз после коммита транзакции
+    со всеми item, накопленными в ней."""
+    batches = getattr(_pending, 'batches', None)
+    if batches is None:
+        batches = _pending.batches = {}
+    batches.setdefault(callback, set()).add(item)
+
+    def flush():
+        items = batches.pop(callback, None)
+        if items:
+            callback(sorted(items))
+
+    # flush ставится на каждый item: откат вложенного savepoint снимает
+    # только свои flush, а первый выполнившийся забирает всю пачку
+    transaction.on_commit(flush)
+
+
+def invalidate_recipes(recipe_ids):
+    for recipe_id in recipe_ids:
+        invalidate('recipes', recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_dictionary_cache(sender, instance, **kwargs):
+    namespace = 'ingredients' if sender is Ingredient else 'tags'
+
+    def callback():
+        invalidate(namespace, instance.pk)
+        invalidate('recipes', shared=True)
+
+    transaction.on_commit(callback)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_cache(instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate('recipes', pk))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientsInRecipe)
+@receiver(post_delete, sender=IngredientsInRecipe)
+def update_recipe_ingredient_index(sender, instance, **kwargs):
+    # Ингредиенты нового рецепта пишутся bulk_create без сигналов,
+    # но в той же транзакции, что и сам рецепт
+    pk = instance.pk if sender is Recipe else instance.recipe_id
+    on_commit_batch(recipe_ingredient_index.invalidate, pk)
+
+
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+@receiver(post_save, sender=IngredientsInRecipe)
+@receiver(post_delete, sender=IngredientsInRecipe)
+def invalidate_recipe_relations_cache(instance, **kwargs):
+    on_commit_batch(invalidate_recipes, instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=RecipeTag)
+@receiver(m2m_changed, sender=IngredientsInRecipe)
+def invalidate_recipe_m2m_cache(instance, action, reverse, pk_set,
+                                **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    else:
+        recipe_ids = list(pk_set or [])
+    if reverse and not recipe_ids:
+        # clear() со стороны тега или ингредиента
+        transaction.on_commit(lambda: invalidate('recipes', shared=True))
+        return
+
+    def callback():
+        for recipe_id in recipe_ids:
+            invalidate('recipes', recipe_id)
+
+    transaction.on_commit(callback)
+
+
+# Поля пользователя, которые выводятся в рецептах как автор
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name', 'avatar'}
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_cache(created, update_fields, **kwargs):
+    # Автор выводится внутри каждого рецепта. У нового пользователя
+    # рецептов нет, вход и смена пароля авторов в ответах не меняют.
+    if created or update_fields and not AUTHOR_FIELDS & set(update_fields):
+        return
+    transaction.on_commit(lambda: invalidate('recipes', shared=True))
+
+
+def scores_changed(recipe_ids):
+    """Пересчет оценок после удаления из избранного или корзины:
+    по created удаление не видно. Выполняется после коммита."""
+    recipe_ids = list(recipe_ids)
+
+    def schedule():
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            enqueue(recompute_scores, recipe_ids[start:start + BATCH_SIZE])
+
+    transaction.on_commit(schedule)
+
+
+@receiver(scores_updated)
+def invalidate_scored_lists(**kwargs):
+    # Порядок popular и trending в закешированных списках устарел
+    transaction.on_commit(lambda: invalidate('recipes'))
+
+
+@receiver(post_delete, sender=ShortLinkRecipe)
+def invalidate_short_link_resolver(**kwargs):
+    transaction.on_commit(invalidate_short_links)
@@ -0,0 +1,150 @@
+import random
+from array import array
+from hashlib import blake2b
+
+from django.db import transaction
+from django.db.models import Count
+from jobs.queue import enqueue
+from reviews.models import (IngredientsInRecipe, Recipe, RecipeBucket,
+                            RecipeSignature, RecipeTag)
+
+# 64 хеш-функции = 16 полос по 4 строки: пара рецептов с похожестью
+# по Жаккару 0.5 попадает в общую корзину с вероятностью ~0.65,
+# с похожестью 0.8 - почти наверняка.
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+# Сколько кандидатов из корзин сравнивать по подписям
+CANDIDATES_LIMIT = 200
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+# Фиксированное зерно: подписи, посчитанные разными процессами
+# и в разное время, должны совпадать
+_random = random.Random(20240901)
+_PERMUTATIONS = [
+    (_random.randrange(1, _PRIME), _random.randrange(_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+
+def _hash(value):
+    return int.from_bytes(
+        blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def get_features(ingredient_ids, tag_ids):
+    return ([f'i{ingredient_id}' for ingredient_id in ingredient_ids]
+            + [f't{tag_id}' for tag_id in tag_ids])
+
+
+def compute_signature(features):
+    """MinHash-подпись множества строк, NUM_PERMUTATIONS чисел uint32."""
+    hashes = [_hash(feature) for feature in set(features)]
+    if not hashes:
+        return array('I', [_MASK] * NUM_PERMUTATIONS)
+    return array('I', (
+        min((a * value + b) % _PRIME for value in hashes) & _MASK
+        for a, b in _PERMUTATIONS
+    ))
+
+
+def get_bucket_keys(signature):
+    """Ключи корзин LSH по полосам подписи."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = blake2b(bytes([band]) + rows.tobytes(), digest_size=8)
+        keys.append(int.from_bytes(digest.digest(), 'big', signed=True))
+    return keys
+
+
+def estimate_similarity(first, second):
+    """Оценка коэффициента Жаккара по двум подписям."""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERMUTATIONS
+
+
+def load_signature(data):
+    signature = array('I')
+    signature.frombytes(bytes(data))
+    return signature
+
+
+def save_signature(recipe_id, signature, created=False):
+    """Записывает подпись и корзины, меняя только изменившиеся полосы."""
+    keys = get_bucket_keys(signature)
+    if created:
+        RecipeSignature.objects.create(
+            recipe_id=recipe_id, minhash=signature.tobytes())
+        RecipeBucket.objects.bulk_create(
+            RecipeBucket(recipe_id=recipe_id, band=band, key=key)
+            for band, key in enumerate(keys))
+        return
+    current, new = RecipeSignature.objects.get_or_create(
+        recipe_id=recipe_id, defaults={'minhash': signature.tobytes()})
+    if new:
+        RecipeBucket.objects.bulk_create(
+            (RecipeBucket(recipe_id=recipe_id, band=band, key=key)
+             for band, key in enumerate(keys)), ignore_conflicts=True)
+        return
+    if bytes(current.minhash) == signature.tobytes():
+        return
+    current.minhash = signature.tobytes()
+    current.save(update_fields=['minhash'])
+    changed = []
+    for bucket in RecipeBucket.objects.filter(recipe_id=recipe_id):
+        if bucket.key != keys[bucket.band]:
+            bucket.key = keys[bucket.band]
+            changed.append(bucket)
+    if changed:
+        RecipeBucket.objects.bulk_update(changed, ['key'])
+
+
+def update_recipe_signature(recipe, ingredient_ids, tag_ids, created=False):
+    save_signature(
+        recipe.id,
+        compute_signature(get_features(ingredient_ids, tag_ids)),
+        created=created)
+
+
+def refresh_recipe_signature(recipe):
+    """Пересчитывает подпись по ингредиентам и тегам из базы."""
+    update_recipe_signature(
+        recipe,
+        IngredientsInRecipe.objects.filter(recipe=recipe).values_list(
+            'ingredient_id', flat=True),
+        RecipeTag.objects.filter(recipe=recipe).values_list(
+            'tag_id', flat=True))
+
+
+@transaction.atomic
+def fill_signature(recipe_id):
+    """Фоновая задача: подпись рецепта, у которого ее еще нет."""
+    recipe = Recipe.objects.filter(id=recipe_id).first()
+    if recipe is not None:
+        refresh_recipe_signature(recipe)
+
+
+def find_similar(recipe, limit):
+    """Пары (recipe_id, похожесть) по убыванию похожести.
+
+    Без подписи - пустой список, подпись считает фоновая задача."""
+    current = RecipeSignature.objects.filter(recipe=recipe).first()
+    if current is None:
+        enqueue(fill_signature, recipe.id)
+        return []
+    signature = load_signature(current.minhash)
+    candidates = RecipeBucket.objects.filter(
+        key__in=get_bucket_keys(signature),
+    ).exclude(recipe=recipe).values('recipe_id').annotate(
+        bands=Count('id'),
+    ).order_by('-bands', '-recipe_id').values_list(
+        'recipe_id', flat=True)[:CANDIDATES_LIMIT]
+    scored = [
+        (recipe_id, estimate_similarity(signature, load_signature(data)))
+        for recipe_id, data in RecipeSignature.objects.filter(
+            recipe_id__in=list(candidates)).values_list(
+            'recipe_id', 'minhash')
+    ]
+    scored.sort(key=lambda item: (-item[1], -item[0]))
+    return scored[:limit]
@@ -0,0 +1,1079 @@
+import base64
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import run_job
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+from reviews.counters import repair_counter
+from reviews.models import (Cart, Favorite, Ingredient, IngredientsInRecipe,
+                            Recipe, RecipeBucket, RecipeSignature,
+                            ShortLinkRecipe, Subscription, Tag, TimelineEntry,
+                            User)
+from reviews.scores import refresh_scores
+
+from .benchmarks import SCENARIOS
+from .feed import fan_out_recipe
+from .filters import RecipeFilter, get_read_recipe_queryset
+from .metrics import registry
+from .search import (bump_version, get_version, ingredient_index,
+                     recipe_ingredient_index)
+from .shortlinks import get_or_create_short_link, make_short_code
+from .signals import on_commit_batch
+from .similarity import BANDS, refresh_recipe_signature
+
+
+def create_user(username, **fields):
+    return User.objects.create(
+        email=f'{username}@example.com', username=username,
+        first_name='Имя', last_name='Фамилия', password='pass', **fields)
+
+
+def create_ingredients(names):
+    return [Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in names]
+
+
+def create_recipe(author, name='Рецепт', ingredients=(), tags=(),
+                  **fields):
+    """ingredients - список или словарь ингредиент: количество."""
+    fields = {'text': 'Описание', 'cooking_time': 10,
+              'image': 'media/recipe/test.png', **fields}
+    recipe = Recipe.objects.create(name=name, author=author, **fields)
+    if tags:
+        recipe.tags.set(tags)
+    if not isinstance(ingredients, dict):
+        ingredients = dict.fromkeys(ingredients, 1)
+    IngredientsInRecipe.objects.bulk_create(
+        IngredientsInRecipe(recipe=recipe, ingredient=ingredient,
+                            amount=amount)
+        for ingredient, amount in ingredients.items()
+    )
+    return recipe
+
+
+class BaseAPITestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def authenticate(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+class RecipeListQueriesTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        Subscription.objects.create(subscriber=cls.reader,
+                                    subscribed=cls.author)
+        tags = [Tag.objects.create(name=f'Тег {i}', slug=f'tag{i}')
+                for i in range(3)]
+        ingredients = create_ingredients(
+            f'ингредиент {i}' for i in range(5))
+        for i in range(30):
+            create_recipe(cls.author, f'Рецепт {i}', {
+                ingredient: index + 1
+                for index, ingredient in enumerate(ingredients)}, tags)
+
+    def get_list(self, limit):
+        return self.client.get(reverse('recipes-list'), {'limit': limit})
+
+    def test_anonymous_list_queries_do_not_depend_on_page_size(self):
+        # count, рецепты, авторы, теги, ингредиенты
+        with self.assertNumQueries(5):
+            small = self.get_list(2)
+        with self.assertNumQueries(5):
+            large = self.get_list(30)
+        self.assertEqual(len(small.data['results']), 2)
+        self.assertEqual(len(large.data['results']), 30)
+
+    def test_authenticated_list_queries_do_not_depend_on_page_size(self):
+        self.authenticate(self.reader)
+        # плюс запрос токена
+        with self.assertNumQueries(6):
+            self.get_list(2)
+        with self.assertNumQueries(6):
+            self.get_list(30)
+
+    def test_cursor_pagination_walks_all_recipes(self):
+        url = reverse('recipes-list') + '?cursor=&limit=7&count=exact'
+        seen = []
+        while url:
+            with self.assertNumQueries(5):
+                data = self.client.get(url).data
+            seen.extend(item['id'] for item in data['results'])
+            self.assertEqual(data['count'], 30)
+            url = data['next']
+        self.assertEqual(
+            seen, list(Recipe.objects.order_by('-pub_date', '-id')
+                       .values_list('id', flat=True)))
+
+    def test_anonymous_list_is_cached_until_recipe_changes(self):
+        with self.assertNumQueries(5):
+            self.get_list(5)
+        with self.assertNumQueries(0):
+            self.get_list(5)
+        recipe = Recipe.objects.first()
+        recipe.name = 'Новое название'
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        with self.assertNumQueries(5):
+            results = self.get_list(5).data['results']
+        self.assertEqual(results[0]['name'], 'Новое название')
+
+    def test_cache_key_includes_host_and_scheme(self):
+        self.get_list(5)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('recipes-list'),
+                                       {'limit': 5}, HTTP_HOST='127.0.0.1')
+        self.assertTrue(
+            response.data['results'][0]['image'].startswith(
+                'http://127.0.0.1/'))
+        with self.assertNumQueries(5):
+            self.client.get(reverse('recipes-list'), {'limit': 5},
+                            secure=True)
+
+    def test_signup_and_password_change_keep_cache(self):
+        self.get_list(5)
+        with self.captureOnCommitCallbacks(execute=True):
+            user = create_user('new')
+            user.set_password('secret')
+            user.save(update_fields=['password'])
+        with self.assertNumQueries(0):
+            self.get_list(5)
+
+    def test_authenticated_list_is_not_cached(self):
+        self.authenticate(self.reader)
+        self.get_list(5)
+        with self.assertNumQueries(6):
+            self.get_list(5)
+
+    def test_list_flags_and_ingredients(self):
+        recipe = Recipe.objects.first()
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        self.authenticate(self.reader)
+        results = self.get_list(30).data['results']
+        flags = {item['id']: item['is_favorited'] for item in results}
+        self.assertTrue(flags.pop(recipe.id))
+        self.assertFalse(any(flags.values()))
+        self.assertTrue(results[0]['author']['is_subscribed'])
+        self.assertFalse(results[0]['is_in_shopping_cart'])
+        self.assertEqual(
+            [item['amount'] for item in results[0]['ingredients']],
+            [1, 2, 3, 4, 5])
+
+    def test_user_list_subscription_flags_use_one_query(self):
+        for i in range(10):
+            create_user(f'user{i}')
+        self.authenticate(self.reader)
+        # токен, count, пользователи, подписки
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('users-list'), {'limit': 20})
+        flags = {item['id']: item['is_subscribed']
+                 for item in response.data['results']}
+        self.assertTrue(flags.pop(self.author.id))
+        self.assertFalse(any(flags.values()))
+
+
+class KeysetPaginationTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        moment = timezone.now().replace(microsecond=500000)
+        cls.users = []
+        for i in range(4):
+            user = create_user(f'user{i}')
+            create_recipe(user, f'Рецепт {i}')
+            cls.users.append(user)
+        # одна миллисекунда, разные микросекунды
+        for i, user in enumerate(cls.users):
+            User.objects.filter(id=user.id).update(
+                date_joined=moment + timedelta(microseconds=i * 100))
+            Recipe.objects.filter(author=user).update(
+                pub_date=moment + timedelta(microseconds=i * 100))
+
+    def walk(self, url):
+        seen = []
+        while url and len(seen) < 10:
+            data = self.client.get(url).data
+            seen.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return seen
+
+    def test_ascending_order_within_one_millisecond(self):
+        self.assertEqual(
+            self.walk(reverse('users-list') + '?cursor=&limit=1'),
+            [user.id for user in self.users])
+
+    def test_descending_order_within_one_millisecond(self):
+        self.assertEqual(
+            self.walk(reverse('recipes-list') + '?cursor=&limit=1'),
+            list(Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)))
+
+
+class ShoppingCartDownloadTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for amounts in ((100, 200), (50, 300), (1, 1)):
+            recipe = create_recipe(cls.user, ingredients=dict(
+                zip((sugar, milk), amounts)))
+            if amounts[0] != 1:
+                Cart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.user)
+
+    def download(self, **params):
+        response = self.client.get(
+            reverse('recipes-download-shopping-cart'), params)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_download_sums_amounts_in_one_query(self):
+        # токен и сгруппированный список
+        with self.assertNumQueries(2):
+            lines = self.download()
+        self.assertEqual(lines, ['молоко,500,мл', 'сахар,150,г'])
+
+    def test_download_formats(self):
+        self.assertEqual(self.download(format='txt')[2:],
+                         ['молоко (мл) — 500', 'сахар (г) — 150'])
+        self.assertEqual(
+            self.download(format='jsonl')[0],
+            '{"name": "молоко", "measurement_unit": "мл", "amount": 500}')
+
+    def test_unknown_format_is_rejected(self):
+        for export_format in ('json', 'xml'):
+            response = self.client.get(
+                reverse('recipes-download-shopping-cart'),
+                {'format': export_format})
+            self.assertEqual(response.status_code, 400, export_format)
+            self.assertIn('format', response.json())
+
+
+class SubscriptionsPreviewTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        for index in range(3):
+            author = create_user(f'author{index}')
+            Subscription.objects.create(subscriber=cls.reader,
+                                        subscribed=author)
+            for number in range(5):
+                create_recipe(author, f'Рецепт {number}')
+        repair_counter('recipes_count')
+
+    def test_recipes_limit_is_applied_per_author(self):
+        self.authenticate(self.reader)
+        # токен, count, авторы, превью рецептов
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('users-subscriptions'),
+                                       {'limit': 10, 'recipes_limit': 2})
+        results = response.data['results']
+        self.assertEqual(len(results), 3)
+        for author in results:
+            self.assertEqual(author['recipes_count'], 5)
+            self.assertEqual([recipe['name'] for recipe in author['recipes']],
+                             ['Рецепт 4', 'Рецепт 3'])
+
+
+class IngredientAutocompleteTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Буррата', 'бульон', 'сахар', 'сахарная пудра'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        super().setUp()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        response = self.client.get(reverse('ingredient-list'), {'name': name})
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search_is_served_from_memory(self):
+        self.search('')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('Саха'), ['сахар', 'сахарная пудра'])
+            self.assertEqual(self.search('бу'), ['бульон', 'Буррата'])
+
+    def test_index_is_invalidated_on_write(self):
+        self.assertEqual(self.search('сахарн'), ['сахарная пудра'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='сахарный сироп',
+                                      measurement_unit='мл')
+        self.assertEqual(self.search('сахарн'),
+                         ['сахарная пудра', 'сахарный сироп'])
+
+    def test_version_bumped_by_other_process_is_picked_up(self):
+        self.search('')
+        Ingredient.objects.create(name='сахарный сироп', measurement_unit='мл')
+        # так индекс сбрасывает load_ingredients в другом контейнере
+        bump_version(ingredient_index.version_name)
+        self.assertEqual(self.search('сахарн'), ['сахарная пудра'])
+        with override_settings(INDEX_RECHECK_SECONDS=0):
+            self.assertEqual(self.search('сахарн'),
+                             ['сахарная пудра', 'сахарный сироп'])
+
+
+class CountersTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        cls.recipe = create_recipe(cls.user)
+
+    def test_favorite_updates_counter(self):
+        self.authenticate(self.user)
+        url = reverse('recipes-favorite', args=[self.recipe.id])
+        self.client.post(url)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.client.delete(url)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_counter_does_not_go_below_zero(self):
+        # рецепт создан в обход API, recipes_count автора остался 0
+        self.authenticate(self.user)
+        response = self.client.delete(
+            reverse('recipes-detail', args=[self.recipe.id]))
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 0)
+
+    def test_user_delete_updates_other_counters(self):
+        reader = create_user('reader')
+        self.authenticate(reader)
+        self.client.post(reverse('recipes-favorite', args=[self.recipe.id]))
+        self.client.post(
+            reverse('recipes-shopping-cart', args=[self.recipe.id]))
+        self.client.post(reverse('users-subscribe', args=[self.user.id]))
+        self.client.delete(reverse('users-detail', args=[reader.id]))
+        self.recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.carts_count, 0)
+        self.assertEqual(self.user.subscribers_count, 0)
+
+    def test_repair_fixes_drift(self):
+        Cart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(repair_counter('carts_count'), 1)
+        self.assertEqual(repair_counter('carts_count'), 0)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.carts_count, 1)
+
+
+class ShortLinkTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recipe = create_recipe(create_user('cook'))
+
+    def test_code_is_deterministic_and_resolved_from_memory(self):
+        url = reverse('recipes-short-link', args=[self.recipe.id])
+        first = self.client.get(url, HTTP_HOST='localhost').data['short-link']
+        self.assertEqual(
+            self.client.get(url, HTTP_HOST='localhost').data['short-link'],
+            first)
+        path = first.split('localhost', 1)[1]
+        self.assertEqual(path, f'/s/{make_short_code(self.recipe.id)}/')
+        self.assertRedirects(self.client.get(path),
+                             f'http://localhost/recipes/{self.recipe.id}',
+                             fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.client.get(path)
+
+    def test_taken_code_falls_back_to_next_attempt(self):
+        ShortLinkRecipe.objects.create(
+            recipe=self.recipe, full_link='http://old/',
+            short_link=make_short_code(self.recipe.id))
+        link = get_or_create_short_link(self.recipe, 'http://new/')
+        self.assertEqual(link.short_link, make_short_code(self.recipe.id, 1))
+
+
+PIXEL_PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADU'
+    'lEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def png_header(width, height):
+    """PNG без пикселей с заданными размерами в заголовке."""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+
+    content = (b'\x89PNG\r\n\x1a\n'
+               + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                            8, 0, 0, 0, 0))
+               + chunk(b'IDAT', zlib.compress(b'')) + chunk(b'IEND', b''))
+    return 'data:image/png;base64,' + base64.b64encode(content).decode()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, JOBS_EAGER=True)
+class RecipeWriteQueriesTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cook')
+        cls.tags = [Tag.objects.create(name=f'Тег {i}', slug=f'tag{i}')
+                    for i in range(4)]
+        cls.ingredients = create_ingredients(
+            f'ингредиент {i}' for i in range(20))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.user)
+
+    def payload(self, count, amount=10, tags=2):
+        return {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'image': PIXEL_PNG,
+            'tags': [tag.id for tag in self.tags[:tags]],
+            'ingredients': [{'id': ingredient.id, 'amount': amount}
+                            for ingredient in self.ingredients[:count]],
+        }
+
+    def create(self, count):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('recipes-list'),
+                                        self.payload(count), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(queries)
+
+    def test_create_queries_do_not_depend_on_ingredient_count(self):
+        _, few = self.create(2)
+        response, many = self.create(20)
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.data['ingredients']), 20)
+        self.assertEqual(RecipeBucket.objects.filter(
+            recipe_id=response.data['id']).count(), BANDS)
+
+    def test_same_image_is_stored_once_with_thumbnails(self):
+        first, _ = self.create(1)
+        second, _ = self.create(1)
+        self.assertEqual(first.data['image'], second.data['image'])
+        self.assertTrue(first.data['image'].endswith('.png'))
+        thumbnails = second.data['thumbnails']
+        self.assertEqual(set(thumbnails), {'list', 'detail'})
+        self.assertTrue(thumbnails['list']['webp'].endswith('_list.webp'))
+        self.assertEqual(
+            len(os.listdir(os.path.join(MEDIA_ROOT, 'media', 'recipe'))), 2)
+
+    def test_bad_images_are_field_errors(self):
+        for image, error in (
+            (png_header(10000, 10000), 'пикселей'),
+            (png_header(15000, 15000), 'пикселей'),
+            ('data:image/png,iVBORw0KGgo=', 'изображение'),
+        ):
+            payload = {**self.payload(1), 'image': image}
+            response = self.client.post(reverse('recipes-list'), payload,
+                                        format='json')
+            self.assertEqual(response.status_code, 400, response.data)
+            self.assertIn(error, str(response.data['image'][0]))
+
+    def test_thumbnails_follow_the_flag(self):
+        response, _ = self.create(1)
+        url = reverse('recipes-detail', args=[response.data['id']])
+        Recipe.objects.update(has_thumbnails=False)
+        self.assertIsNone(self.client.get(url).data['thumbnails'])
+        call_command('generate_thumbnails', stdout=StringIO())
+        self.assertIsNotNone(self.client.get(url).data['thumbnails'])
+
+    def test_patch_writes_only_the_difference(self):
+        response, _ = self.create(5)
+        url = reverse('recipes-detail', args=[response.data['id']])
+        payload = self.payload(6, tags=3)
+        payload['ingredients'][0]['amount'] = 99
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        sql = [query['sql'] for query in queries]
+        self.assertFalse(any(query.startswith('DELETE') for query in sql))
+        self.assertEqual(
+            sum(query.startswith('INSERT') for query in sql), 2)
+        amounts = [item['amount'] for item in response.data['ingredients']]
+        self.assertEqual(sorted(amounts), [10, 10, 10, 10, 10, 99])
+        self.assertEqual(len(response.data['tags']), 3)
+
+
+class RecipeFilterTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('filter')
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        cls.egg, cls.milk, cls.salt = create_ingredients(
+            ('яйцо', 'молоко', 'соль'))
+        cls.omelette = create_recipe(
+            cls.user, 'Омлет', [cls.egg, cls.milk, cls.salt],
+            [cls.breakfast, cls.dinner])
+        cls.boiled_egg = create_recipe(
+            cls.user, 'Яйцо всмятку', [cls.egg, cls.salt], [cls.breakfast],
+            cooking_time=5)
+        cls.soup = create_recipe(cls.user, 'Суп', [cls.salt], [cls.dinner],
+                                 cooking_time=60)
+        Favorite.objects.create(user=cls.user, recipe=cls.soup)
+
+    def get_ids(self, **params):
+        response = self.client.get(reverse('recipes-list'),
+                                   {'limit': 10, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return {item['id'] for item in response.data['results']}
+
+    def test_filters_combine(self):
+        self.assertEqual(
+            self.get_ids(tags=['breakfast', 'dinner']),
+            {self.omelette.id, self.boiled_egg.id, self.soup.id})
+        self.assertEqual(
+            self.get_ids(ingredients=[self.egg.id, self.salt.id]),
+            {self.omelette.id, self.boiled_egg.id})
+        self.assertEqual(
+            self.get_ids(tags='dinner', ingredients=self.egg.id,
+                         max_cooking_time=10),
+            {self.omelette.id})
+        self.assertEqual(self.get_ids(min_cooking_time=11), {self.soup.id})
+
+    def test_is_favorited_accepts_false(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.get_ids(is_favorited=1), {self.soup.id})
+        self.assertEqual(self.get_ids(is_favorited=0),
+                         {self.omelette.id, self.boiled_egg.id})
+        self.assertEqual(len(self.get_ids(is_favorited='')), 3)
+
+    def test_search_ranks_name_matches_first(self):
+        pancake = create_recipe(self.user, 'Блины', [self.egg, self.milk],
+                                [self.breakfast], cooking_time=20)
+        Recipe.objects.filter(id=pancake.id).update(
+            text='Тонкие, как Омлет')
+        response = self.client.get(reverse('recipes-list'),
+                                   {'limit': 10, 'search': 'Омлет'})
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [self.omelette.id, pancake.id])
+        response = self.client.get(reverse('recipes-list'), {
+            'limit': 10, 'search': 'Омлет', 'cursor': '', 'ordering': 'new'})
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         [self.omelette.id, pancake.id])
+        self.assertEqual(self.get_ids(search='Омлет', max_cooking_time=10),
+                         {self.omelette.id})
+
+    def test_filtered_query_has_no_distinct_and_uses_indexes(self):
+        request = RequestFactory().get('/', {
+            'tags': ['breakfast', 'dinner'],
+            'ingredients': [self.egg.id, self.milk.id],
+            'is_favorited': 'true', 'is_in_shopping_cart': 'false',
+            'min_cooking_time': 5,
+        })
+        request.user = self.user
+        queryset = RecipeFilter(
+            request.GET, queryset=get_read_recipe_queryset(self.user),
+            request=request).qs
+        self.assertNotIn('DISTINCT', str(queryset.query).upper())
+        plan = queryset.explain()
+        self.assertNotIn('DISTINCT', plan.upper())
+        if connection.vendor == 'sqlite':
+            # Полный проход только по самой таблице рецептов, каждый
+            # EXISTS - поиск по индексу
+            scans = [line for line in plan.splitlines() if 'SCAN' in line]
+            self.assertEqual(len(scans), 1, plan)
+            self.assertIn('reviews_recipe', scans[0])
+
+
+class WhatCanICookTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # данные класса не коммитятся, пачки on_commit_batch сбрасываем сразу
+        with cls.captureOnCommitCallbacks(execute=True):
+            user = create_user('cook')
+            cls.egg, cls.milk, cls.salt = create_ingredients(
+                ('яйцо', 'молоко', 'соль'))
+            cls.omelette = create_recipe(user, 'Омлет',
+                                         [cls.egg, cls.milk, cls.salt])
+            cls.boiled_egg = create_recipe(user, 'Яйцо всмятку',
+                                           [cls.egg, cls.salt])
+            cls.brine = create_recipe(user, 'Рассол', [cls.salt])
+
+    def setUp(self):
+        super().setUp()
+        recipe_ingredient_index.invalidate()
+
+    def cook(self, *ingredients, **params):
+        response = self.client.get(
+            reverse('recipes-what-can-i-cook'),
+            {'ingredients': [ingredient.id for ingredient in ingredients],
+             **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(item['id'], item['missing_count'])
+                for item in response.data]
+
+    def test_recipes_are_ranked_by_missing_ingredients(self):
+        expected = [(self.boiled_egg.id, 0), (self.brine.id, 0),
+                    (self.omelette.id, 1)]
+        # версия и загрузка индекса, рецепты, авторы, теги, ингредиенты
+        with self.assertNumQueries(6):
+            self.assertEqual(self.cook(self.egg, self.salt), expected)
+        with self.assertNumQueries(4):
+            self.assertEqual(self.cook(self.egg, self.salt), expected)
+        self.assertEqual(self.cook(self.egg, self.salt, max_missing=0),
+                         expected[:2])
+        self.assertEqual(self.cook(self.milk, limit=1),
+                         [(self.omelette.id, 2)])
+
+    def test_index_is_updated_only_for_changed_recipe(self):
+        self.cook(self.salt)
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientsInRecipe.objects.create(
+                recipe=self.brine, ingredient=self.milk, amount=1)
+        with CaptureQueriesContext(connection) as queries:
+            matches = recipe_ingredient_index.match([self.milk.id], 10)
+        # версия из базы и строки только измененного рецепта
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"recipe_id" IN (', queries[1]['sql'])
+        self.assertEqual(matches, [(self.brine.id, 1),
+                                   (self.omelette.id, 2)])
+
+    def test_transaction_bumps_index_version_once(self):
+        index = recipe_ingredient_index
+        version = get_version(index.version_name)
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientsInRecipe.objects.filter(recipe=self.omelette).delete()
+            IngredientsInRecipe.objects.create(
+                recipe=self.brine, ingredient=self.milk, amount=1)
+        self.assertEqual(get_version(index.version_name), version + 1)
+        self.assertEqual(cache.get(index.changes_key.format(version + 1)),
+                         sorted([self.omelette.id, self.brine.id]))
+
+    def test_batch_survives_rolled_back_savepoint(self):
+        calls = []
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    on_commit_batch(calls.append, 1)
+                    raise ValueError
+            on_commit_batch(calls.append, 2)
+        self.assertEqual(calls, [[1, 2]])
+
+    def test_ingredients_are_required(self):
+        response = self.client.get(reverse('recipes-what-can-i-cook'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+
+
+class SimilarRecipesTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = create_user('similar')
+        breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        dinner = Tag.objects.create(name='Ужин', slug='dinner')
+        ingredients = create_ingredients(
+            f'ингредиент {i}' for i in range(12))
+        cls.omelette = create_recipe(user, 'Омлет', ingredients[:6],
+                                     [breakfast])
+        cls.frittata = create_recipe(user, 'Фриттата', ingredients[:7],
+                                     [breakfast])
+        cls.soup = create_recipe(user, 'Суп', ingredients[6:], [dinner])
+
+    def get_similar(self, recipe):
+        response = self.client.get(
+            reverse('recipes-similar', args=[recipe.id]))
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(item['id'], item['similarity']) for item in response.data]
+
+    def test_rebuild_command_fills_signatures_and_buckets(self):
+        call_command('rebuild_similarity', workers=2, stdout=StringIO())
+        self.assertEqual(RecipeSignature.objects.count(), 3)
+        self.assertEqual(RecipeBucket.objects.count(), 3 * BANDS)
+        similar = self.get_similar(self.omelette)
+        self.assertEqual(similar[0][0], self.frittata.id)
+        self.assertGreater(similar[0][1], 0.5)
+        self.assertNotIn(self.soup.id, dict(similar))
+
+    def test_missing_signature_is_queued_not_computed(self):
+        for recipe in (self.frittata, self.soup):
+            refresh_recipe_signature(recipe)
+        self.assertEqual(self.get_similar(self.omelette), [])
+        self.assertFalse(
+            RecipeSignature.objects.filter(recipe=self.omelette).exists())
+        job = Job.objects.get()
+        self.assertEqual(job.args, [self.omelette.id])
+        run_job(job)
+        run_job(job)
+        self.assertEqual(self.get_similar(self.omelette)[0][0],
+                         self.frittata.id)
+
+
+@override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=1, JOBS_EAGER=True)
+class FeedTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.star, cls.stranger = (
+            create_user(name)
+            for name in ('reader', 'author', 'star', 'stranger'))
+        # Популярнее порога FEED_FANOUT_MAX_SUBSCRIBERS
+        User.objects.filter(id=cls.star.id).update(subscribers_count=100)
+        cls.old = cls.create_recipe(cls.author, 'Старый рецепт', 1)
+
+    @classmethod
+    def create_recipe(cls, author, name, day):
+        recipe = create_recipe(author, name)
+        pub_date = timezone.now() - timedelta(days=30 - day)
+        Recipe.objects.filter(id=recipe.id).update(pub_date=pub_date)
+        recipe.pub_date = pub_date
+        fan_out_recipe(recipe.id)
+        return recipe
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.reader)
+        for author in (self.author, self.star):
+            self.client.post(reverse('users-subscribe', args=[author.id]))
+
+    def get_feed(self, url=None):
+        response = self.client.get(url or f'{reverse("recipes-feed")}?limit=2')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_feed_merges_pushed_and_popular_recipes(self):
+        star_recipe = self.create_recipe(self.star, 'Звездный', 2)
+        new = self.create_recipe(self.author, 'Новый', 3)
+        self.create_recipe(self.stranger, 'Чужой', 4)
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe=star_recipe).exists())
+        # токен, лента, популярные авторы, рецепты, авторы, теги,
+        # ингредиенты
+        with self.assertNumQueries(7):
+            first = self.get_feed()
+        second = self.get_feed(first['next'])
+        self.assertEqual(
+            [item['id'] for item in first['results'] + second['results']],
+            [new.id, star_recipe.id, self.old.id])
+        self.assertIsNone(second['next'])
+
+    def test_unsubscribe_removes_author_from_feed(self):
+        self.client.delete(reverse('users-subscribe', args=[self.author.id]))
+        self.assertEqual(self.get_feed()['results'], [])
+
+    def test_rebuild_timelines_fills_existing_subscriptions(self):
+        # подписка создана в обход API, ее лента пуста
+        Subscription.objects.create(subscriber=self.stranger,
+                                    subscribed=self.author)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.stranger, recipe=self.old).exists())
+
+    def test_author_below_threshold_is_pushed_to_feeds(self):
+        star_recipe = self.create_recipe(self.star, 'Звездный', 2)
+        Subscription.objects.create(subscriber=self.stranger,
+                                    subscribed=self.star)
+        User.objects.filter(id=self.star.id).update(subscribers_count=2)
+        self.authenticate(self.stranger)
+        self.client.delete(reverse('users-subscribe', args=[self.star.id]))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=star_recipe).exists())
+
+
+class RecipeScoresTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'fan{i}') for i in range(2)]
+        cls.classic, cls.hit, cls.unknown = (
+            create_recipe(cls.users[0], name)
+            for name in ('Классика', 'Хит', 'Неизвестный'))
+        for user in cls.users:
+            Favorite.objects.create(user=user, recipe=cls.classic)
+        Favorite.objects.update(created=timezone.now() - timedelta(days=10))
+        Cart.objects.create(user=cls.users[0], recipe=cls.hit)
+        # старше запаса refresh_scores, иначе попадет в следующий запуск
+        Cart.objects.update(created=timezone.now() - timedelta(hours=1))
+
+    def get_ids(self, **params):
+        response = self.client.get(reverse('recipes-list'),
+                                   {'limit': 10, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [item['id'] for item in response.data['results']]
+
+    def test_popular_and_trending_orderings(self):
+        refresh_scores(full=True)
+        self.assertEqual(self.get_ids(ordering='popular'),
+                         [self.classic.id, self.hit.id, self.unknown.id])
+        self.assertEqual(self.get_ids(ordering='trending'),
+                         [self.hit.id, self.classic.id, self.unknown.id])
+        pages = []
+        url = reverse('recipes-list')
+        params = {'ordering': 'trending', 'limit': 1, 'cursor': ''}
+        while url:
+            response = self.client.get(url, params)
+            pages += [item['id'] for item in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(pages, self.get_ids(ordering='trending'))
+
+    def test_incremental_refresh_touches_only_new_activity(self):
+        self.assertEqual(refresh_scores(), 2)
+        Favorite.objects.create(user=self.users[1], recipe=self.unknown)
+        self.assertEqual(refresh_scores(), 1)
+        self.assertEqual(self.get_ids(ordering='trending')[0],
+                         self.unknown.id)
+
+    def test_refresh_invalidates_cached_lists(self):
+        refresh_scores(full=True)
+        self.assertEqual(self.get_ids(ordering='popular')[0], self.classic.id)
+        Favorite.objects.filter(recipe=self.classic).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_scores(full=True)
+        self.assertEqual(self.get_ids(ordering='popular')[0], self.hit.id)
+
+    def test_activity_committed_after_refresh_is_not_skipped(self):
+        refresh_scores()
+        # строку вставили до прошлого запуска, а закоммитили после
+        Favorite.objects.create(user=self.users[1], recipe=self.unknown)
+        Favorite.objects.filter(recipe=self.unknown).update(
+            created=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(refresh_scores(), 1)
+        self.unknown.refresh_from_db()
+        self.assertEqual(self.unknown.popular_score, 2)
+
+    def test_watermark_survives_cache_clear(self):
+        refresh_scores()
+        cache.clear()
+        Favorite.objects.create(user=self.users[1], recipe=self.unknown)
+        self.assertEqual(refresh_scores(), 1)
+
+    @override_settings(JOBS_EAGER=True)
+    def test_removing_favorite_lowers_score(self):
+        refresh_scores()
+        self.authenticate(self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(
+                reverse('recipes-favorite', args=[self.classic.id]))
+        self.classic.refresh_from_db()
+        self.assertEqual(self.classic.popular_score, 2)
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class MetricsTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_recipe(create_user('metrics'))
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_server_timing_and_metrics_endpoint(self):
+        response = self.client.get(reverse('recipes-list'), {'limit': 6})
+        timing = response['Server-Timing']
+        for name in ('db', 'serialize', 'render', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+        self.assertIn('desc="5 queries"', timing)
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'foodgram_db_queries_bucket{view="recipes-list",le="5"} 1',
+            metrics)
+        self.assertIn('foodgram_render_seconds_count{view="recipes-list"} 1',
+                      metrics)
+
+    def test_metrics_are_hidden_from_other_hosts(self):
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+
+class LoadIngredientsTest(BaseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def load(self, name, content, batch_size=2):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        call_command('load_ingredients', path=path, batch_size=batch_size,
+                     stdout=StringIO())
+
+    def units(self):
+        return dict(Ingredient.objects.values_list(
+            'name', 'measurement_unit'))
+
+    def test_rerun_is_idempotent(self):
+        csv = 'name,measurement_unit\nсоль,г\nсахар,г\nмука,г\n'
+        self.load('ingredients.csv', csv)
+        ids = set(Ingredient.objects.values_list('id', flat=True))
+        self.load('ingredients.csv', csv)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(self.units(),
+                         {'соль': 'г', 'сахар': 'г', 'мука': 'г'})
+
+    def test_json_adds_and_updates(self):
+        self.load('ingredients.csv', 'name,measurement_unit\nсоль,г\n')
+        self.load('ingredients.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'щепотка'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+        ]))
+        self.assertEqual(self.units(),
+                         {'соль': 'щепотка', 'молоко': 'мл'})
+
+    def test_batch_size_must_be_positive(self):
+        with self.assertRaises(CommandError):
+            self.load('ingredients.csv', 'name,measurement_unit\n',
+                      batch_size=0)
+        self.assertFalse(Ingredient.objects.exists())
+
+
+class SeedFakeDataTest(BaseAPITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_ingredients(f'Ингредиент {number}' for number in range(30))
+
+    def seed(self):
+        call_command('seed_fake_data', users=40, recipes=120, seed=7,
+                     batch_size=50, stdout=StringIO())
+        return (
+            list(Recipe.objects.order_by('id').values_list(
+                'id', 'name', 'author_id', 'favorites_count')),
+            list(IngredientsInRecipe.objects.order_by(
+                'recipe_id', 'ingredient_id').values_list(
+                'recipe_id', 'ingredient_id', 'amount')),
+            list(Subscription.objects.order_by(
+                'subscriber_id', 'subscribed_id').values_list(
+                'subscriber_id', 'subscribed_id')),
+        )
+
+    def test_same_seed_gives_same_data(self):
+        first = self.seed()
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(len(first[0]), 120)
+        self.assertTrue(all(
+            count >= 2 for count in IngredientsInRecipe.objects.values(
+                'recipe').annotate(count=Count('id')).values_list(
+                'count', flat=True)))
+        self.assertEqual(repair_counter('favorites_count'), 0)
+        User.objects.all().delete()
+        self.assertEqual(self.seed(), first)
+
+    def test_dates_are_spread_into_the_past(self):
+        self.seed()
+        hour_ago = timezone.now() - timedelta(hours=1)
+        self.assertTrue(Recipe.objects.filter(pub_date__lt=hour_ago).exists())
+        self.assertTrue(Favorite.objects.filter(created__lt=hour_ago).exists())
+        self.assertTrue(Recipe._meta.get_field('pub_date').auto_now_add)
+
+
+class BenchmarkTest(APITransactionTestCase):
+    """Прогон коммитит каждый запрос, как на одноразовой базе."""
+
+    def setUp(self):
+        cache.clear()
+        create_ingredients(f'Ингредиент {number}' for number in range(30))
+        call_command('seed_fake_data', users=30, recipes=100, seed=1,
+                     stdout=StringIO())
+
+    def test_requires_disposable_database(self):
+        with self.assertRaises(CommandError):
+            call_command('bench_api', requests=1, stdout=StringIO())
+
+    def test_endpoints_stay_within_query_budgets(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        call_command('bench_api', requests=3, warmup=1, output=output,
+                     disposable=True, stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            results = json.load(file)['scenarios']
+        shutil.rmtree(os.path.dirname(output))
+        self.assertEqual(set(results),
+                         {scenario.name for scenario in SCENARIOS})
+        for name, result in results.items():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'], name)
+            self.assertTrue(result['within_budget'], name)
+        self.assertEqual(results['recipes-list-anonymous']['queries_max'],
+                         0)
+
+
+class TrafficReplayTest(APITransactionTestCase):
+    """Запросы идут из потоков со своими соединениями, поэтому данные
+    должны быть закоммичены."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('replay')
+        self.recipe = create_recipe(self.user)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_replay_reports_routes_and_errors(self):
+        log = os.path.join(self.directory, 'traffic.jsonl')
+        output = os.path.join(self.directory, 'report.json')
+        lines = [
+            {'path': '/api/recipes/', 'query': {'limit': 6}, 'time': 0},
+            {'path': f'/api/recipes/{self.recipe.id}/', 'time': 0.01},
+            {'path': '/api/recipes/0/', 'time': 0.02},
+            {'method': 'post', 'user': 'replay@example.com', 'time': 0.03,
+             'path': f'/api/recipes/{self.recipe.id}/favorite/'},
+            {'path': '/api/users/me/', 'user': 0},
+            {'request_id': 'user-001', 'title': 'Не запрос'},
+        ]
+        with open(log, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(line) + '\n' for line in lines)
+        call_command('replay_traffic', log, concurrency=2, speedup=0,
+                     output=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['skipped_writes'], 1)
+        self.assertFalse(Favorite.objects.exists())
+        call_command('replay_traffic', log, concurrency=2, speedup=0,
+                     writes=True, output=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            report = json.load(file)
+        routes = report['routes']
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(report['requests'], 4)
+        self.assertEqual(report['skipped_lines'], 1)
+        self.assertEqual(report['unknown_users'], 1)
+        self.assertEqual(routes['GET recipes-list']['statuses'], {'200': 1})
+        self.assertEqual(routes['GET recipes-detail']['error_rate'], 0.5)
+        self.assertEqual(routes['POST recipes-favorite']['statuses'],
+                         {'201': 1})
+        self.assertTrue(Favorite.objects.filter(
+            user=self.user, recipe=self.recipe).exists())
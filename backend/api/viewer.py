@@ -0,0 +1,52 @@
+from django.utils.functional import cached_property
+from reviews.models import Cart, Favorite, Subscription
+
+
+class ViewerContext:
+    """Подписки, избранное и корзина текущего пользователя для флагов."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, model, user_field, id_field):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(model.objects.filter(
+            **{user_field: self.user}).values_list(id_field, flat=True))
+
+    @cached_property
+    def subscribed_ids(self):
+        return self._ids(Subscription, 'subscriber', 'subscribed_id')
+
+    @cached_property
+    def favorite_ids(self):
+        return self._ids(Favorite, 'user', 'recipe_id')
+
+    @cached_property
+    def cart_ids(self):
+        return self._ids(Cart, 'user', 'recipe_id')
+
+    def is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        return author.id in self.subscribed_ids
+
+    def is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+        return recipe.id in self.favorite_ids
+
+    def is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+        return recipe.id in self.cart_ids
+
+
+def get_viewer(request):
+    """ViewerContext, общий для всех сериализаторов одного запроса."""
+    http_request = getattr(request, '_request', request)
+    viewer = getattr(http_request, 'viewer_context', None)
+    if viewer is None or viewer.user != request.user:
+        viewer = ViewerContext(request.user)
+        http_request.viewer_context = viewer
+    return viewer
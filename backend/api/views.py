@@ -1,32 +1,59 @@
+from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import (SAFE_METHODS, AllowAny,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from reviews.counters import change_counter, change_counters
 from reviews.models import (Cart, Favorite, Ingredient, Recipe,
                             ShortLinkRecipe, Subscription, Tag, User)
 
+from .cache import AnonymousCacheMixin
+from .exporters import EXPORTERS
+from .feed import Feed, fill_demoted_authors, remove_from_timeline
 from .filters import (RecipeFilter, SearchFilterNameParam,
-                      get_filter_recipe_queryset)
-from .pagination import PageLimitPagination
-from .serializers import (CreateListCartSerializer, CreateUserSerializer,
-                          IngredientsSerializer, PasswordSetSerializer,
-                          ReadRecipeSerializer, ReadSubscribeToUserSerializer,
-                          ShortLinkRecipeSerializer, TagSerializer,
-                          UserAvatarSerializer, UserSerializer,
+                      get_read_recipe_queryset, get_recipe_ordering,
+                      get_subscribed_authors_queryset,
+                      prefetch_recipe_previews)
+from .metrics import registry
+from .pagination import (CursorPageLimitPagination, FeedPagination,
+                         LimitOffsetPaginationRecipesParam)
+from .renderers import CSVRenderer, JSONLinesRenderer, TextRenderer
+from .search import ingredient_index, recipe_ingredient_index
+from .serializers import (CookableQuerySerializer, CookableRecipeSerializer,
+                          CreateListCartSerializer, CreateUserSerializer,
+                          IngredientsSerializer, LimitQuerySerializer,
+                          PasswordSetSerializer, ReadRecipeSerializer,
+                          ReadSubscribeToUserSerializer,
+                          ShortLinkRecipeSerializer, SimilarRecipeSerializer,
+                          TagSerializer, UserAvatarSerializer, UserSerializer,
                           WriteCartRecipeSerializer,
                           WriteFavoriteRecipeSerializer, WriteRecipeSerializer,
                           WriteSubscribeToUserSerializer)
+from .shortlinks import resolve_short_link
+from .signals import scores_changed
+from .similarity import find_similar
+
+
+def get_recipes_limit(request):
+    """Значение ?recipes_limit= или None, если ограничения нет."""
+    return LimitOffsetPaginationRecipesParam().get_page_size(request)
 
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = CreateUserSerializer
-    pagination_class = PageLimitPagination
+    pagination_class = CursorPageLimitPagination
+    cursor_ordering = ('date_joined', 'id')
     http_method_names = ['get', 'list', 'post', 'put', 'delete']
 
     def get_serializer_class(self):
@@ -34,6 +61,23 @@ class UserViewSet(viewsets.ModelViewSet):
             return UserSerializer
         return CreateUserSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # каскад удалит подписки, избранное и корзину пользователя,
+        # счетчики чужих авторов и рецептов уменьшаются заранее
+        change_counters('subscribers_count', Subscription.objects.filter(
+            subscriber=instance).values('subscribed_id'), -1)
+        change_counters('favorites_count', Favorite.objects.filter(
+            user=instance).values('recipe_id'), -1)
+        change_counters('carts_count', Cart.objects.filter(
+            user=instance).values('recipe_id'), -1)
+        scores_changed(Recipe.objects.filter(
+            Q(favorites__user=instance) | Q(carts__user=instance)
+        ).values_list('id', flat=True).distinct())
+        fill_demoted_authors(Subscription.objects.filter(
+            subscriber=instance).values('subscribed_id'))
+        instance.delete()
+
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,))
     def me(self, request):
@@ -48,7 +92,7 @@ class UserViewSet(viewsets.ModelViewSet):
         user = request.user
         if user.check_password(serializer.data.get('current_password')):
             user.set_password(serializer.data.get('new_password'))
-            user.save()
+            user.save(update_fields=['password'])
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'errors': 'Указан неверный пароль'},
                         status=status.HTTP_400_BAD_REQUEST)
@@ -76,7 +120,8 @@ class UserViewSet(viewsets.ModelViewSet):
     def subscribe(self, request, pk=None):
         user = get_object_or_404(User, id=pk)
         serializer = WriteSubscribeToUserSerializer(
-            user, context={'request': request})
+            user, context={'request': request,
+                           'recipes_limit': get_recipes_limit(request)})
         if not serializer.data.get('errors'):
             return Response(serializer.data,
                             status=status.HTTP_201_CREATED)
@@ -94,33 +139,42 @@ class UserViewSet(viewsets.ModelViewSet):
         except Exception:
             return Response({'Вы не подписаны на данного пользователя'},
                             status=status.HTTP_400_BAD_REQUEST)
-        obj.delete()
+        with transaction.atomic():
+            obj.delete()
+            change_counter('subscribers_count', user.id, -1)
+            remove_from_timeline(request.user.id, user.id)
+            fill_demoted_authors([user.id])
         return Response(None, status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = user.subscriptions.all().values_list(
-            'subscribed', flat=True)
-        subscriptions_users = User.objects.filter(id__in=subscriptions)
+        recipes_limit = get_recipes_limit(request)
+        context = {'request': request, 'recipes_limit': recipes_limit}
+        subscriptions_users = get_subscribed_authors_queryset(request.user)
         page = self.paginate_queryset(subscriptions_users)
         if page is not None:
-            serializer = ReadSubscribeToUserSerializer(page, many=True)
+            prefetch_recipe_previews(page, recipes_limit)
+            serializer = ReadSubscribeToUserSerializer(page, many=True,
+                                                       context=context)
             return self.get_paginated_response(serializer.data)
+        subscriptions_users = prefetch_recipe_previews(
+            list(subscriptions_users), recipes_limit)
         serializer = ReadSubscribeToUserSerializer(subscriptions_users,
-                                                   many=True)
+                                                   many=True, context=context)
         return Response(serializer.data)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     http_method_names = ['get', 'list']
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientsSerializer
     http_method_names = ['get', 'list']
@@ -128,21 +182,49 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_backends = (SearchFilterNameParam,)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        # Индекс в памяти отвечает быстрее кеша, кешируется только
+        # поиск через базу.
+        if not settings.INGREDIENT_PREFIX_INDEX:
+            return super().list(request, *args, **kwargs)
+        name = request.query_params.get(SearchFilterNameParam.search_param,
+                                        '')
+        return Response(ingredient_index.search(name))
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    pagination_class = PageLimitPagination
+class RecipeViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
+    cache_namespace = 'recipes'
+    pagination_class = CursorPageLimitPagination
     http_method_names = ['get', 'list', 'post', 'patch', 'delete']
     permission_classes = (IsAuthenticatedOrReadOnly,)
     ordering = ['-pub_date']
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self):
+        return get_recipe_ordering(self.request)
+
     def get_queryset(self):
-        return get_filter_recipe_queryset(self)
+        return get_read_recipe_queryset(self.request.user)
+
+    def perform_content_negotiation(self, request, force=False):
+        # Неизвестный формат списка покупок - 400, а не 404 от DRF
+        if not force and self.action == 'download_shopping_cart':
+            export_format = request.query_params.get('format', 'csv')
+            if export_format not in EXPORTERS:
+                raise ValidationError({
+                    'format': f'Доступные форматы: {", ".join(EXPORTERS)}'})
+        return super().perform_content_negotiation(request, force)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        change_counter('recipes_count', instance.author_id, -1)
+
     def destroy(self, request, pk):
         instance = self.get_object()
         if request.user != instance.author:
@@ -181,7 +263,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
         except Exception:
             return Response({'Вы добавляли элемент в корзину'},
                             status=status.HTTP_400_BAD_REQUEST)
-        obj.delete()
+        with transaction.atomic():
+            obj.delete()
+            change_counter('carts_count', recipe.id, -1)
+            scores_changed([recipe.id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'],
@@ -208,7 +293,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
         except Exception:
             return Response({'Вы добавляли элемент в избранное'},
                             status=status.HTTP_400_BAD_REQUEST)
-        obj.delete()
+        with transaction.atomic():
+            obj.delete()
+            change_counter('favorites_count', recipe.id, -1)
+            scores_changed([recipe.id])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['get'],
@@ -226,16 +314,73 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Новые рецепты авторов из подписок, постранично по ?cursor=."""
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(
+            Feed(request.user, get_read_recipe_queryset(request.user)),
+            request, view=self)
+        serializer = ReadRecipeSerializer(page, many=True,
+                                          context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'],
+            permission_classes=(AllowAny,))
+    def similar(self, request, pk=None):
+        """Рецепты с похожим набором ингредиентов и тегов."""
+        recipe = get_object_or_404(Recipe, id=pk)
+        query = LimitQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        similarity = dict(find_similar(
+            recipe, limit=query.validated_data['limit']))
+        recipes = get_read_recipe_queryset(request.user).in_bulk(similarity)
+        serializer = SimilarRecipeSerializer(
+            [recipes[pk] for pk in similarity if pk in recipes], many=True,
+            context={'request': request, 'similarity': similarity})
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(AllowAny,),
+            url_path='what-can-i-cook')
+    def what_can_i_cook(self, request):
+        """Рецепты из имеющихся ингредиентов, по числу недостающих."""
+        query = CookableQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        matches = recipe_ingredient_index.match(
+            query.validated_data['ingredients'],
+            limit=query.validated_data['limit'],
+            max_missing=query.validated_data.get('max_missing'))
+        missing = dict(matches)
+        recipes = get_read_recipe_queryset(request.user).in_bulk(missing)
+        serializer = CookableRecipeSerializer(
+            [recipes[pk] for pk, _ in matches if pk in recipes], many=True,
+            context={'request': request, 'missing': missing})
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(JSONRenderer, CSVRenderer,
+                              TextRenderer, JSONLinesRenderer))
     def download_shopping_cart(self, request):
         serializer = CreateListCartSerializer(
             context={'request': request})
-        response = serializer.download_csv()
-        return response
+        return serializer.download(
+            request.query_params.get('format', 'csv'))
 
 
 def redirect_link(request, short_link):
     """Данный метод используется в backend.url.
     для переадресации коротких ссылок"""
-    link = get_object_or_404(ShortLinkRecipe,
-                             short_link=short_link)
-    return redirect(link.full_link)
+    try:
+        full_link = resolve_short_link(short_link)
+    except ShortLinkRecipe.DoesNotExist:
+        raise Http404
+    return redirect(full_link)
+
+
+def metrics(request):
+    """Гистограммы MetricsMiddleware в формате Prometheus."""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
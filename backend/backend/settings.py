@@ -15,14 +15,21 @@ from pathlib import Path
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
 
-sentry_sdk.init(
-    dsn="https://9fbaf6cf9ecc08f712b414ca4cffc620@o4507349538897920.ingest.us.sentry.io/4507938923544576",
-    integrations=[
-        DjangoIntegration(),
-    ],
-    traces_sample_rate=1.0,
-    profiles_sample_rate=1.0,
-)
+# Sentry включается переменной SENTRY_DSN. Трассировка и профилирование
+# каждого запроса дороги, поэтому по умолчанию выключены; локальные
+# замеры дает MetricsMiddleware (/metrics).
+SENTRY_DSN = os.getenv('SENTRY_DSN', '')
+if SENTRY_DSN:
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[
+            DjangoIntegration(),
+        ],
+        traces_sample_rate=float(
+            os.getenv('SENTRY_TRACES_SAMPLE_RATE', '0')),
+        profiles_sample_rate=float(
+            os.getenv('SENTRY_PROFILES_SAMPLE_RATE', '0')),
+    )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,10 +60,13 @@ INSTALLED_APPS = [
     'django_filters',
     'api.apps.ApiConfig',
     'reviews.apps.ReviewsConfig',
+    'jobs.apps.JobsConfig',
+    'diagnostics.apps.DiagnosticsConfig',
     'djoser',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +74,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'diagnostics.middleware.QueryDiagnosticsMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -110,6 +121,65 @@ DATABASES = {
     }
 }
 
+if os.getenv('USE_SQLITE', 'False') == 'True':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Кеш ответов API для анонимных пользователей. Без Redis:
+# locmem по умолчанию или общий для всех воркеров файловый кеш
+# (CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache,
+# CACHE_LOCATION=/var/tmp/foodgram_cache)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+
+API_CACHE_TIMEOUT = 60 * 10
+# Как часто процесс сверяет версии индексов в памяти (api/search.py)
+# с базой
+INDEX_RECHECK_SECONDS = 5
+
+# Фоновые задачи в базе (python manage.py run_worker).
+# JOBS_EAGER=True выполняет задачи сразу, без воркера.
+JOBS_EAGER = os.getenv('JOBS_EAGER', 'False') == 'True'
+JOBS_BACKOFF_SECONDS = 30
+# Сколько дней хранить выполненные задачи, чистит run_worker
+JOBS_DONE_RETENTION_DAYS = 7
+
+# Лента подписок: рецепты авторов с числом подписчиков до порога
+# раскладываются по лентам при публикации, рецепты более популярных
+# авторов подмешиваются при чтении.
+FEED_FANOUT_MAX_SUBSCRIBERS = 10_000
+# Сколько последних рецептов автора добавить в ленту при подписке
+FEED_BACKFILL_RECIPES = 100
+
+# Период полураспада вклада избранного и корзины в ?ordering=trending
+TRENDING_HALF_LIFE_HOURS = 24
+
+# Доля запросов с замерами MetricsMiddleware (Server-Timing, /metrics)
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '1'))
+# Адреса, с которых можно читать /metrics
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
+# Отчеты о медленных запросах и N+1 (админка, manage.py slow_queries).
+# Включать на стенде или ненадолго: каждый медленный SELECT
+# выполняется повторно под EXPLAIN ANALYZE.
+SLOW_QUERY_DIAGNOSTICS = os.getenv('SLOW_QUERY_DIAGNOSTICS',
+                                   'False') == 'True'
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+# Сколько одинаковых по форме запросов за один запрос к API считать N+1
+SLOW_QUERY_REPEAT_THRESHOLD = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -152,6 +222,11 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Ограничения для изображений в base64, проверяются до декодирования.
+# Тело запроса и так ограничено DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 МБ).
+IMAGE_MAX_BYTES = 2 * 1024 * 1024
+IMAGE_MAX_PIXELS = 25_000_000
+
 REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -162,6 +237,10 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Автодополнение ингредиентов из индекса в памяти процесса,
+# False - поиск через базу (SearchFilterNameParam)
+INGREDIENT_PREFIX_INDEX = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -1,4 +1,4 @@
-from api.views import redirect_link
+from api.views import metrics, redirect_link
 from django.contrib import admin
 from django.urls import include, path
 
@@ -6,4 +6,5 @@ urlpatterns = [
     path('api/', include('api.urls')),
     path('admin/', admin.site.urls),
     path('s/<short_link>/', redirect_link, name='redirect_link'),
+    path('metrics', metrics, name='metrics'),
 ]
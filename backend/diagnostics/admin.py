@@ -0,0 +1,23 @@
+from django.contrib import admin
+
+from .models import QueryReport
+
+
+class QueryReportAdmin(admin.ModelAdmin):
+    list_display = (
+        'created',
+        'kind',
+        'view',
+        'duration',
+        'count',
+    )
+    list_filter = ('kind', 'view')
+    search_fields = ('sql', 'view')
+    readonly_fields = ('kind', 'view', 'path', 'sql', 'duration', 'count',
+                       'plan', 'created')
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(QueryReport, QueryReportAdmin)
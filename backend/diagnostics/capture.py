@@ -0,0 +1,76 @@
+import re
+import time
+from collections import defaultdict
+
+from django.db import DatabaseError, connection, transaction
+
+from .models import QueryReport
+
+# Списки параметров IN (%s, %s, ...) разной длины - один и тот же запрос
+_PARAMS_LIST = re.compile(r'%s(?:, %s)+')
+
+EXPLAIN_PREFIXES = {
+    'postgresql': 'EXPLAIN (ANALYZE, BUFFERS) ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def get_shape(sql):
+    return _PARAMS_LIST.sub('%s, ...', sql)
+
+
+def explain(sql, params):
+    """План запроса; для Postgres с фактическим выполнением."""
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return f'EXPLAIN не выполнен: {error}'
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+
+class QueryCapture:
+    """Медленные и повторяющиеся SQL-запросы одного запроса к API."""
+
+    def __init__(self, threshold_ms, repeat_threshold):
+        self.threshold_ms = threshold_ms
+        self.repeat_threshold = repeat_threshold
+        self.slow = []
+        self.shapes = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= self.threshold_ms and not many:
+                self.slow.append((sql, params, duration))
+            shape = self.shapes[get_shape(sql)]
+            shape[0] += 1
+            shape[1] += duration
+
+    def get_reports(self, view, path):
+        reports = [
+            QueryReport(kind=QueryReport.SLOW, view=view, path=path,
+                        sql=sql, duration=duration,
+                        plan=explain(sql, params))
+            for sql, params, duration in self.slow
+        ]
+        reports += [
+            QueryReport(kind=QueryReport.REPEATED, view=view, path=path,
+                        sql=sql, duration=duration, count=count)
+            for sql, (count, duration) in self.shapes.items()
+            if count >= self.repeat_threshold
+        ]
+        return reports
+
+    def save(self, view, path):
+        reports = self.get_reports(view, path[:255])
+        if reports:
+            QueryReport.objects.bulk_create(reports)
+        return reports
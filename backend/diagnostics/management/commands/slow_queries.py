@@ -0,0 +1,45 @@
+from diagnostics.models import QueryReport
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+
+
+class Command(BaseCommand):
+    help = 'Show slow and repeated (N+1) queries captured per view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=[
+            kind for kind, _ in QueryReport.KIND_CHOICES])
+        parser.add_argument('--view', help='Например RecipeViewSet.list')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--plan', action='store_true',
+                            help='Показать последний план EXPLAIN')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить все отчеты')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = QueryReport.objects.all().delete()
+            self.stdout.write(f'Удалено отчетов: {deleted}')
+            return
+        reports = QueryReport.objects.all()
+        if options['kind']:
+            reports = reports.filter(kind=options['kind'])
+        if options['view']:
+            reports = reports.filter(view=options['view'])
+        groups = reports.values('kind', 'view', 'sql').annotate(
+            reports=Count('id'), max_duration=Max('duration'),
+            repeats=Max('count'), total=Sum('duration'),
+        ).order_by('-total')[:options['limit']]
+        for group in groups:
+            self.stdout.write(self.style.WARNING(
+                f'{group["kind"]} {group["view"]}: '
+                f'отчетов {group["reports"]}, '
+                f'максимум {group["max_duration"]:.1f} мс, '
+                f'повторов до {group["repeats"]}'))
+            self.stdout.write(group['sql'])
+            if options['plan'] and group['kind'] == QueryReport.SLOW:
+                latest = reports.filter(
+                    kind=group['kind'], view=group['view'],
+                    sql=group['sql']).first()
+                self.stdout.write(latest.plan)
+            self.stdout.write('')
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .capture import QueryCapture
+
+
+def get_view_label(view_func, method):
+    """RecipeViewSet.list, UserViewSet.subscriptions или имя функции."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower(), method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class QueryDiagnosticsMiddleware:
+    """Отчеты о медленных и повторяющихся SQL-запросах вью."""
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_DIAGNOSTICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        capture = QueryCapture(settings.SLOW_QUERY_THRESHOLD_MS,
+                               settings.SLOW_QUERY_REPEAT_THRESHOLD)
+        request.query_view = None
+        with connection.execute_wrapper(capture):
+            response = self.get_response(request)
+        if request.query_view is None:
+            return response
+        if response.streaming:
+            # Выгрузки читают базу, пока отдают ответ
+            response.streaming_content = self.capture_stream(
+                response.streaming_content, capture, request)
+        else:
+            capture.save(request.query_view, request.path)
+        return response
+
+    def capture_stream(self, content, capture, request):
+        with connection.execute_wrapper(capture):
+            yield from content
+        capture.save(request.query_view, request.path)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_view = get_view_label(view_func, request.method)
@@ -0,0 +1,27 @@
+from django.db import models
+
+
+class QueryReport(models.Model):
+    SLOW = 'slow'
+    REPEATED = 'repeated'
+    KIND_CHOICES = (
+        (SLOW, 'Медленный запрос'),
+        (REPEATED, 'Повтор в запросе (N+1)'),
+    )
+    kind = models.CharField('Тип', max_length=10, choices=KIND_CHOICES)
+    view = models.CharField('Вью', max_length=255)
+    path = models.CharField('Путь', max_length=255)
+    sql = models.TextField('SQL')
+    duration = models.FloatField('Время, мс')
+    count = models.PositiveIntegerField('Повторов', default=1)
+    plan = models.TextField('План запроса', blank=True)
+    created = models.DateTimeField('Записан', auto_now_add=True,
+                                   db_index=True)
+
+    class Meta:
+        verbose_name = 'отчет о запросе'
+        verbose_name_plural = 'отчеты о запросах'
+        ordering = ['-created', '-id']
+
+    def __str__(self):
+        return f'{self.get_kind_display()} в {self.view}'
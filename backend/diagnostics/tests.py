@@ -0,0 +1,49 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from reviews.models import Recipe, User
+
+from .capture import QueryCapture, get_shape
+from .models import QueryReport
+
+
+@override_settings(SLOW_QUERY_DIAGNOSTICS=True, SLOW_QUERY_THRESHOLD_MS=0)
+class QueryDiagnosticsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Рецептов', password='pass')
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', cooking_time=10,
+            image='media/recipe/test.png', author=cls.author)
+
+    def test_slow_queries_are_saved_with_view_and_plan(self):
+        self.client.get(reverse('recipes-list'), {'limit': 6})
+        reports = QueryReport.objects.filter(kind=QueryReport.SLOW)
+        self.assertEqual({report.view for report in reports},
+                         {'RecipeViewSet.list'})
+        self.assertTrue(all(report.plan for report in reports))
+        output = StringIO()
+        call_command('slow_queries', plan=True, stdout=output)
+        self.assertIn('RecipeViewSet.list', output.getvalue())
+
+    def test_repeated_query_shapes_are_reported(self):
+        capture = QueryCapture(threshold_ms=1000, repeat_threshold=3)
+        with connection.execute_wrapper(capture):
+            for pk in range(3):
+                list(User.objects.filter(id=pk))
+            list(User.objects.filter(id__in=[1, 2]))
+            list(User.objects.filter(id__in=[1, 2, 3]))
+        reports = capture.save('test', '/test/')
+        self.assertEqual([report.kind for report in reports],
+                         [QueryReport.REPEATED])
+        self.assertEqual(reports[0].count, 3)
+
+    def test_in_lists_share_one_shape(self):
+        self.assertEqual(get_shape('id IN (%s, %s)'),
+                         get_shape('id IN (%s, %s, %s)'))
@@ -0,0 +1,18 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'task',
+        'status',
+        'attempts',
+        'run_at',
+        'created',
+    )
+    list_filter = ('status', 'task')
+    search_fields = ('task',)
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from jobs.queue import claim_job, prune_done, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument(
+            '--stale-after', type=int, default=600,
+            help='Через сколько секунд RUNNING-задача считается зависшей')
+        parser.add_argument(
+            '--maintenance-interval', type=float, default=60.0,
+            help='Как часто возвращать зависшие задачи в очередь '
+                 'и удалять старые выполненные')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить все готовые задачи и выйти')
+
+    def work(self, stop, options):
+        processed = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = claim_job()
+                if job is None:
+                    if options['once']:
+                        break
+                    stop.wait(options['poll_interval'])
+                    continue
+                job = run_job(job)
+                processed += 1
+                self.stdout.write(f'{job.task}: {job.status}')
+        finally:
+            connection.close()
+        return processed
+
+    def maintain(self, options):
+        close_old_connections()
+        requeued = requeue_stale(options['stale_after'])
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь: {requeued}')
+        pruned = prune_done(settings.JOBS_DONE_RETENTION_DAYS)
+        if pruned:
+            self.stdout.write(f'Удалено выполненных задач: {pruned}')
+
+    def handle(self, *args, **options):
+        self.maintain(options)
+        stop = threading.Event()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            futures = [pool.submit(self.work, stop, options)
+                       for _ in range(options['threads'])]
+            try:
+                while wait(futures,
+                           timeout=options['maintenance_interval']).not_done:
+                    self.maintain(options)
+                processed = sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                stop.set()
+                processed = sum(future.result() for future in futures)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено задач: {processed} '
+            f'за {time.monotonic() - started:.2f} с'))
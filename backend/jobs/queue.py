@@ -0,0 +1,82 @@
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def task_path(task):
+    if isinstance(task, str):
+        return task
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, *args, run_at=None, max_attempts=3, **kwargs):
+    """Ставит вызов task(*args, **kwargs) в очередь."""
+    if settings.JOBS_EAGER:
+        import_string(task_path(task))(*args, **kwargs)
+        return None
+    return Job.objects.create(
+        task=task_path(task), args=list(args), kwargs=kwargs,
+        max_attempts=max_attempts, run_at=run_at or timezone.now())
+
+
+def claim_job():
+    """Берет одну готовую к запуску задачу или возвращает None."""
+    candidates = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=timezone.now()
+    ).values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_at=timezone.now())
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run_job(job, backoff=None):
+    if backoff is None:
+        backoff = settings.JOBS_BACKOFF_SECONDS
+    job.attempts += 1
+    try:
+        with transaction.atomic():
+            import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(
+                seconds=backoff * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+        logger.warning('Задача %s упала (попытка %s)', job, job.attempts)
+    else:
+        job.status = Job.DONE
+    job.locked_at = None
+    job.save(update_fields=['attempts', 'status', 'run_at',
+                            'locked_at', 'last_error'])
+    return job
+
+
+def requeue_stale(timeout):
+    """Возвращает в очередь задачи, зависшие в RUNNING после падения
+    воркера."""
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=Job.QUEUED, locked_at=None)
+
+
+def prune_done(days):
+    """Удаляет выполненные задачи старше days дней."""
+    deleted, _ = Job.objects.filter(
+        status=Job.DONE, run_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return deleted
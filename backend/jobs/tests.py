@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim_job, enqueue, prune_done, requeue_stale, run_job
+
+CALLS = []
+
+
+def record(value):
+    CALLS.append(value)
+
+
+def explode():
+    raise RuntimeError('boom')
+
+
+class QueueTest(TestCase):
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_job_runs_once(self):
+        enqueue(record, 42)
+        job = claim_job()
+        self.assertIsNone(claim_job())
+        self.assertEqual(run_job(job).status, Job.DONE)
+        self.assertEqual(CALLS, [42])
+
+    def test_failed_job_is_retried_with_backoff(self):
+        enqueue(explode, max_attempts=2)
+        job = run_job(claim_job(), backoff=60)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIsNone(claim_job())
+        Job.objects.update(run_at=timezone.now())
+        job = run_job(claim_job(), backoff=60)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('boom', job.last_error)
+
+    def test_stale_job_is_requeued(self):
+        enqueue(record, 1)
+        job = claim_job()
+        self.assertEqual(requeue_stale(60), 0)
+        Job.objects.update(locked_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(requeue_stale(60), 1)
+        self.assertEqual(claim_job(), job)
+
+    def test_old_done_jobs_are_pruned(self):
+        for value in (1, 2):
+            run_job(enqueue(record, value))
+        enqueue(record, 3)
+        Job.objects.filter(args=[1]).update(
+            run_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(prune_done(7), 1)
+        self.assertEqual(sorted(Job.objects.values_list('args', flat=True)),
+                         [[2], [3]])
@@ -9,23 +9,25 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'email',
-        'username'
+        'username',
+        'recipes_count',
+        'subscribers_count',
     )
     search_fields = ('email', 'last_name')
+    readonly_fields = ('recipes_count', 'subscribers_count')
 
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'name',
         'author',
-        'get_favorite_count'
+        'favorites_count',
+        'carts_count',
     )
     search_fields = ('name', 'author')
     list_filter = ('tags',)
-
-    def get_favorite_count(self, obj):
-        return obj.favorites.count()
-    get_favorite_count.short_description = 'Количество в избранном'
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'carts_count')
 
 
 class IngredientAdmin(admin.ModelAdmin):
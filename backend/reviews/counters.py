@@ -0,0 +1,46 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Cart, Favorite, Recipe, Subscription, User
+
+# поле счетчика: (модель владельца, модель строк, поле связи с владельцем)
+COUNTERS = {
+    'favorites_count': (Recipe, Favorite, 'recipe'),
+    'carts_count': (Recipe, Cart, 'recipe'),
+    'recipes_count': (User, Recipe, 'author'),
+    'subscribers_count': (User, Subscription, 'subscribed'),
+}
+
+
+def change_counter(field, pk, delta):
+    """Атомарно меняет счетчик одной строки: UPDATE ... SET f = f + delta."""
+    change_counters(field, [pk], delta)
+
+
+def change_counters(field, pks, delta):
+    """Меняет счетчик строк pks (список или подзапрос), не ниже нуля:
+    строки, созданные в обход API, могли не попасть в счетчик."""
+    model = COUNTERS[field][0]
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(field):
+    _, related_model, relation = COUNTERS[field]
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{relation: OuterRef('pk')}
+        ).order_by().values(relation).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def repair_counter(field):
+    """Пересчитывает счетчик там, где он разошелся с данными."""
+    model = COUNTERS[field][0]
+    drifted = model.objects.annotate(
+        actual=actual_count(field)
+    ).exclude(**{field: F('actual')}).values('pk')
+    return model.objects.filter(pk__in=drifted).update(
+        **{field: actual_count(field)})
@@ -0,0 +1,45 @@
+from django.db import connections
+
+from .models import Ingredient, Recipe
+
+RECIPE_TABLE = Recipe._meta.db_table
+# Название важнее описания: веса A и B для ts_rank
+RECIPE_SEARCH_VECTOR = (
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({row}text, '')), 'B')"
+)
+
+POSTGRES_INDEXES = (
+    # Поиск по префиксу ?name= превращается в
+    # UPPER("name"::text) LIKE UPPER('...%'), обычный btree по name
+    # для него не подходит.
+    f'CREATE INDEX IF NOT EXISTS ingredient_name_upper_pattern_idx '
+    f'ON {Ingredient._meta.db_table} (UPPER(name::text) text_pattern_ops)',
+    f'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    f'ON {RECIPE_TABLE} USING GIN (search_vector)',
+    # search_vector пересчитывается при записи name или text, в том числе
+    # при bulk_create и update() в обход моделей
+    f'CREATE OR REPLACE FUNCTION recipe_search_vector_update() '
+    f'RETURNS trigger AS $$ BEGIN '
+    f'NEW.search_vector := {RECIPE_SEARCH_VECTOR.format(row="NEW.")}; '
+    f'RETURN NEW; END $$ LANGUAGE plpgsql',
+    f'DROP TRIGGER IF EXISTS recipe_search_vector_trigger ON {RECIPE_TABLE}',
+    f'CREATE TRIGGER recipe_search_vector_trigger '
+    f'BEFORE INSERT OR UPDATE OF name, text ON {RECIPE_TABLE} '
+    f'FOR EACH ROW EXECUTE PROCEDURE recipe_search_vector_update()',
+    f'UPDATE {RECIPE_TABLE} '
+    f'SET search_vector = {RECIPE_SEARCH_VECTOR.format(row="")} '
+    f'WHERE search_vector IS NULL',
+)
+
+
+def create_postgres_indexes(using, **kwargs):
+    """Индексы и триггеры, которые нельзя описать в Meta моделей."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for sql in POSTGRES_INDEXES:
+            cursor.execute(sql)
@@ -0,0 +1,107 @@
+import json
+import random
+import shutil
+import tempfile
+import time
+
+from api.benchmarks import SCENARIOS, run_benchmarks
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+from reviews.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Benchmark API endpoints: latency percentiles, throughput '
+            'and query budgets')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Запросов на разогрев, не учитываются')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--only', nargs='+', metavar='SCENARIO',
+            choices=[scenario.name for scenario in SCENARIOS],
+            help='Только эти сценарии')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--baseline',
+                            help='JSON прошлого прогона для сравнения')
+        parser.add_argument(
+            '--tolerance', type=float,
+            help='Допустимый рост p95 относительно baseline, '
+                 'например 0.2 - на 20%%')
+        parser.add_argument(
+            '--disposable', action='store_true',
+            help='Подтверждение, что базу не жалко: созданные рецепты, '
+                 'корзина и ссылки остаются в ней')
+
+    def run(self, options):
+        """Каждый запрос коммитится, как под сервером приложений,
+        поэтому в замеры входят коммит и работа on_commit."""
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                return run_benchmarks(
+                    random.Random(options['seed']), options['requests'],
+                    options['warmup'], options['only'])
+        except (LookupError, AssertionError) as error:
+            raise CommandError(error)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def compare(self, results, baseline_path, tolerance):
+        """Изменение p95 по сценариям; возвращает сценарии, выросшие
+        больше tolerance."""
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)['scenarios']
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]['p95_ms']
+            change = result['p95_ms'] / before - 1 if before else 0
+            self.stdout.write(f'{name}: p95 {before:.2f} -> '
+                              f'{result["p95_ms"]:.2f} мс ({change:+.0%})')
+            if tolerance is not None and change > tolerance:
+                regressions.append(name)
+        return regressions
+
+    def handle(self, *args, **options):
+        if not options['disposable']:
+            raise CommandError('Прогон пишет в базу и не откатывается; '
+                               'запускайте на копии с --disposable')
+        if not Recipe.objects.exists():
+            raise CommandError('База пуста, сначала запустите '
+                               'seed_fake_data')
+        started = time.monotonic()
+        results = self.run(options)
+        self.stdout.write(f'{"сценарий":<26}{"p50":>8}{"p95":>8}{"p99":>8}'
+                          f'{"rps":>8}{"запросы":>9}{"бюджет":>8}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<26}{result["p50_ms"]:>8.2f}{result["p95_ms"]:>8.2f}'
+                f'{result["p99_ms"]:>8.2f}{result["rps"]:>8.0f}'
+                f'{result["queries_max"]:>9}{result["budget"]:>8}')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'recipes': Recipe.objects.count(),
+                    'requests': options['requests'],
+                    'seed': options['seed'],
+                    'scenarios': results,
+                }, file, ensure_ascii=False, indent=2)
+        failures = [name for name, result in results.items()
+                    if not result['within_budget']]
+        if options['baseline']:
+            failures += self.compare(results, options['baseline'],
+                                     options['tolerance'])
+        if failures:
+            raise CommandError(
+                f'Превышен бюджет запросов или p95: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с'))
@@ -0,0 +1,91 @@
+import time
+
+from api.feed import Feed, fan_out_recipe
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q
+from reviews.models import Recipe, Subscription, TimelineEntry, User
+
+
+class Command(BaseCommand):
+    help = 'Compare fan-out-on-write feed with fan-out-on-read'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='id читателя (по умолчанию - с наибольшим '
+                                 'числом подписок)')
+        parser.add_argument('--pages', type=int, default=5,
+                            help='Сколько страниц ленты листать')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def get_reader(self, user_id):
+        users = User.objects.annotate(following=Count('subscriptions'))
+        if user_id:
+            reader = users.filter(id=user_id).first()
+        else:
+            reader = users.order_by('-following').first()
+        if reader is None or not reader.following:
+            raise CommandError('Нет пользователя с подписками')
+        return reader
+
+    def read_on_demand(self, reader, pages, limit):
+        """Fan-out-on-read: рецепты всех авторов из подписок джойном."""
+        authors = Subscription.objects.filter(
+            subscriber=reader).values('subscribed_id')
+        position = None
+        for _ in range(pages):
+            recipes = Recipe.objects.only('id', 'pub_date').filter(
+                author__in=authors)
+            if position is not None:
+                recipes = recipes.filter(
+                    Q(pub_date__lt=position[0])
+                    | Q(pub_date=position[0], id__lt=position[1]))
+            page = list(recipes.order_by('-pub_date', '-id')[:limit])
+            if len(page) < limit:
+                return
+            position = (page[-1].pub_date, page[-1].id)
+
+    def read_timeline(self, reader, pages, limit):
+        """Гибридная лента: TimelineEntry + популярные авторы."""
+        feed = Feed(reader, Recipe.objects.only('id', 'pub_date'))
+        position = None
+        for _ in range(pages):
+            page = feed.page(position, limit)
+            if len(page) < limit:
+                return
+            position = (page[-1].pub_date, page[-1].id)
+
+    def measure(self, func, repeat, *args):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(*args)
+        return (time.perf_counter() - started) / repeat * 1000
+
+    def handle(self, *args, **options):
+        reader = self.get_reader(options['user'])
+        arguments = (reader, options['pages'], options['limit'])
+        on_read = self.measure(
+            self.read_on_demand, options['repeat'], *arguments)
+        on_write = self.measure(
+            self.read_timeline, options['repeat'], *arguments)
+        self.stdout.write(
+            f'Читатель {reader.id}, подписок: {reader.following}, '
+            f'страниц: {options["pages"]} по {options["limit"]}\n'
+            f'fan-out-on-read: {on_read:.2f} мс на ленту\n'
+            f'гибридная лента: {on_write:.2f} мс на ленту')
+        recipe = Recipe.objects.filter(
+            author__subscribers__isnull=False).order_by('-pub_date').first()
+        if recipe is None:
+            return
+        # Стоимость записи: раскладка рецепта по лентам подписчиков,
+        # откатывается после замера
+        with transaction.atomic():
+            TimelineEntry.objects.filter(recipe=recipe).delete()
+            started = time.perf_counter()
+            fan_out_recipe(recipe.id)
+            spent = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(True)
+        self.stdout.write(
+            f'раскладка рецепта {recipe.id} по лентам '
+            f'{recipe.author.subscribers_count} подписчиков: {spent:.2f} мс')
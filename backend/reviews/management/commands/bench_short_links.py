@@ -0,0 +1,41 @@
+import random
+import time
+
+from api.shortlinks import _resolve
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from reviews.models import ShortLinkRecipe
+
+
+class Command(BaseCommand):
+    help = 'Measure /s/<short_link>/ redirects per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def run(self, client, codes, cold):
+        started = time.perf_counter()
+        for code in codes:
+            if cold:
+                _resolve.cache_clear()
+            response = client.get(f'/s/{code}/')
+            if response.status_code != 302:
+                raise CommandError(
+                    f'/s/{code}/ ответил {response.status_code}')
+        return len(codes) / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        codes = list(ShortLinkRecipe.objects.exclude(
+            short_link=None).values_list('short_link', flat=True))
+        if not codes:
+            raise CommandError('В базе нет коротких ссылок')
+        rng = random.Random(options['seed'])
+        sample = rng.choices(codes, k=options['requests'])
+        client = Client(SERVER_NAME='localhost')
+        cold = self.run(client, sample, cold=True)
+        warm = self.run(client, sample, cold=False)
+        self.stdout.write(
+            f'Ссылок: {len(codes)}, запросов: {len(sample)}\n'
+            f'без кеша: {cold:.0f} редиректов/с\n'
+            f'с LRU-кешем: {warm:.0f} редиректов/с')
@@ -0,0 +1,18 @@
+from api.images import generate_thumbnails
+from django.core.management.base import BaseCommand
+from jobs.queue import enqueue
+from reviews.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Queue thumbnail generation for recipes that have none'
+
+    def handle(self, *args, **options):
+        names = Recipe.objects.filter(has_thumbnails=False).exclude(
+            image='').order_by().values_list('image', flat=True).distinct()
+        count = 0
+        for name in names.iterator():
+            enqueue(generate_thumbnails, name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Поставлено задач миниатюр: {count}'))
@@ -1,19 +1,78 @@
 import csv
+import json
 import os
+import time
 
-from django.core.management.base import BaseCommand
+from api.cache import invalidate
+from api.search import ingredient_index
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from reviews.models import Ingredient
 
 
 class Command(BaseCommand):
-    help = 'Load ingredients from CSV file'
+    help = 'Load ingredients from CSV or JSON file'
 
-    def handle(self, *args, **kwargs):
-        file_path = os.path.join('data', 'ingredients.csv')
-        with open(file_path, mode='r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                Ingredient.objects.create(
-                    name=row['name'],
-                    measurement_unit=row['measurement_unit']
-                )
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=os.path.join('data', 'ingredients.csv'),
+            help='Путь к ingredients.csv или ingredients.json')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пачки для bulk_create/bulk_update')
+
+    def read_rows(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, mode='r', encoding='utf-8') as file:
+            if extension == '.csv':
+                rows = list(csv.DictReader(file))
+            elif extension == '.json':
+                rows = json.load(file)
+            else:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+        return {row['name']: row['measurement_unit'] for row in rows}
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть не меньше 1')
+        try:
+            rows = self.read_rows(options['path'])
+        except OSError as error:
+            raise CommandError(error)
+        with transaction.atomic():
+            existing = {
+                ingredient.name: ingredient
+                for ingredient in Ingredient.objects.only(
+                    'id', 'name', 'measurement_unit')
+            }
+            new = [Ingredient(name=name, measurement_unit=unit)
+                   for name, unit in rows.items() if name not in existing]
+            changed = []
+            for name, unit in rows.items():
+                ingredient = existing.get(name)
+                if ingredient and ingredient.measurement_unit != unit:
+                    ingredient.measurement_unit = unit
+                    changed.append(ingredient)
+            for start in range(0, len(new), batch_size):
+                Ingredient.objects.bulk_create(
+                    new[start:start + batch_size], ignore_conflicts=True)
+                self.stdout.write(
+                    f'Добавлено {min(start + batch_size, len(new))}'
+                    f' из {len(new)}')
+            Ingredient.objects.bulk_update(
+                changed, ['measurement_unit'], batch_size=batch_size)
+            if new or changed:
+                transaction.on_commit(ingredient_index.invalidate)
+                transaction.on_commit(
+                    lambda: invalidate('ingredients', shared=True))
+            if changed:
+                # Единицы измерения выводятся в рецептах
+                transaction.on_commit(
+                    lambda: invalidate('recipes', shared=True))
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {len(rows)}, добавлено {len(new)}, '
+            f'обновлено {len(changed)}, без изменений '
+            f'{len(rows) - len(new) - len(changed)} '
+            f'за {time.monotonic() - started:.2f} с'))
@@ -0,0 +1,77 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from api.similarity import compute_signature, get_bucket_keys, get_features
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from reviews.models import (IngredientsInRecipe, Recipe, RecipeBucket,
+                            RecipeSignature, RecipeTag)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild MinHash signatures and LSH buckets for similar recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов для расчета подписей')
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Сколько рецептов читать и записывать за раз')
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только рецепты без подписи')
+
+    def get_batches(self, batch_size, missing):
+        recipes = Recipe.objects.order_by('id')
+        if missing:
+            recipes = recipes.filter(signature__isnull=True)
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        for start in range(0, len(recipe_ids), batch_size):
+            yield recipe_ids[start:start + batch_size]
+
+    def load_features(self, recipe_ids):
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        tags = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in IngredientsInRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        for recipe_id, tag_id in RecipeTag.objects.filter(
+                recipe_id__in=recipe_ids).values_list('recipe_id', 'tag_id'):
+            tags[recipe_id].append(tag_id)
+        return [get_features(ingredients[recipe_id], tags[recipe_id])
+                for recipe_id in recipe_ids]
+
+    @transaction.atomic
+    def save_batch(self, recipe_ids, signatures):
+        RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeBucket.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeSignature.objects.bulk_create(
+            RecipeSignature(recipe_id=recipe_id, minhash=signature.tobytes())
+            for recipe_id, signature in zip(recipe_ids, signatures))
+        RecipeBucket.objects.bulk_create(
+            RecipeBucket(recipe_id=recipe_id, band=band, key=key)
+            for recipe_id, signature in zip(recipe_ids, signatures)
+            for band, key in enumerate(get_bucket_keys(signature)))
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        workers = max(options['workers'], 1)
+        total = 0
+        # Подписи считаются в дочерних процессах, чтение и запись
+        # в базу остаются в основном
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for recipe_ids in self.get_batches(options['batch_size'],
+                                               options['missing']):
+                features = self.load_features(recipe_ids)
+                signatures = list(executor.map(
+                    compute_signature, features,
+                    chunksize=max(len(features) // workers, 1)))
+                self.save_batch(recipe_ids, signatures)
+                total += len(recipe_ids)
+                self.stdout.write(f'Обработано {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Подписи пересчитаны для {total} рецептов '
+            f'за {time.monotonic() - started:.2f} с'))
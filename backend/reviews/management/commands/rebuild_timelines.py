@@ -0,0 +1,36 @@
+import time
+
+from api.feed import fill_author_timelines
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from reviews.models import TimelineEntry, User
+
+
+class Command(BaseCommand):
+    help = 'Fill feed timelines from existing subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Сначала удалить все записи лент')
+        parser.add_argument(
+            '--author', type=int, nargs='+',
+            help='Только подписчики этих авторов')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['clear']:
+            TimelineEntry.objects.all().delete()
+        authors = User.objects.filter(
+            subscribers_count__gt=0,
+            subscribers_count__lte=settings.FEED_FANOUT_MAX_SUBSCRIBERS,
+        ).order_by('id').values_list('id', flat=True)
+        if options['author']:
+            authors = authors.filter(id__in=options['author'])
+        total = 0
+        for author_id in list(authors):
+            with transaction.atomic():
+                total += fill_author_timelines(author_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей лент: {total} за {time.monotonic() - started:.1f} с'))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reviews.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = 'Recompute popular and trending scores of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты, а не только с новыми действиями')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        updated = refresh_scores(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Оценки пересчитаны для {updated} рецептов '
+            f'за {time.monotonic() - started:.2f} с'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from reviews.counters import COUNTERS, repair_counter
+
+
+class Command(BaseCommand):
+    help = 'Recount denormalized favorite, cart, recipe and subscriber counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'fields', nargs='*',
+            help=f'Какие счетчики пересчитать: {", ".join(COUNTERS)} '
+                 '(по умолчанию все)')
+
+    def handle(self, *args, **options):
+        unknown = set(options['fields']) - set(COUNTERS)
+        if unknown:
+            raise CommandError(f'Неизвестные счетчики: {", ".join(unknown)}')
+        for field in options['fields'] or COUNTERS:
+            with transaction.atomic():
+                fixed = repair_counter(field)
+            self.stdout.write(f'{field}: исправлено строк {fixed}')
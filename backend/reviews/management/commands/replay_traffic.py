@@ -0,0 +1,95 @@
+import json
+
+from api.replay import LogEntry, TrafficReplay
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Replay a JSON-lines request log against the WSGI app '
+            'and report per-route latency and error rates')
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='Журнал запросов в JSON Lines')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Одновременных запросов')
+        parser.add_argument(
+            '--speedup', type=float, default=1.0,
+            help='Во сколько раз быстрее журнала, 0 - без пауз')
+        parser.add_argument('--limit', type=int,
+                            help='Воспроизвести только первые N запросов')
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument(
+            '--writes', action='store_true',
+            help='Воспроизводить и запросы с записью; изменения '
+                 'останутся в базе')
+
+    def read_log(self, path, limit):
+        entries = []
+        skipped = 0
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = LogEntry.parse(line)
+                if entry is None:
+                    skipped += 1
+                    continue
+                entries.append(entry)
+                if limit and len(entries) >= limit:
+                    break
+        return entries, skipped
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['speedup'] < 0:
+            raise CommandError('--concurrency должен быть не меньше 1, '
+                               '--speedup - не меньше 0')
+        try:
+            entries, skipped = self.read_log(options['log'],
+                                             options['limit'])
+        except OSError as error:
+            raise CommandError(error)
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено строк без method/path: {skipped}'))
+        if not entries:
+            raise CommandError('В журнале нет HTTP-запросов')
+        if options['writes']:
+            self.stdout.write(self.style.WARNING(
+                'Запросы с записью изменят базу без отката, '
+                'запускайте на копии'))
+        replay = TrafficReplay(entries, options['concurrency'],
+                               options['speedup'], options['writes'])
+        report = replay.report(replay.run())
+        self.stdout.write(f'{"маршрут":<40}{"запросы":>9}{"p50":>9}'
+                          f'{"p95":>9}{"p99":>9}{"ошибки":>9}')
+        for route, result in report['routes'].items():
+            self.stdout.write(
+                f'{route:<40}{result["requests"]:>9}'
+                f'{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                f'{result["p99_ms"]:>9.2f}{result["error_rate"]:>9.1%}')
+        if report['skipped_writes']:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено запросов с записью: {report["skipped_writes"]}, '
+                f'воспроизвести их - --writes'))
+        if report['unknown_users']:
+            self.stdout.write(self.style.WARNING(
+                f'Пропущено запросов неизвестных пользователей: '
+                f'{report["unknown_users"]}'))
+        if options['output']:
+            report.update({
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'log': options['log'],
+                'skipped_lines': skipped,
+                'concurrency': options['concurrency'],
+                'speedup': options['speedup'],
+                'writes': options['writes'],
+            })
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Запросов: {report["requests"]} за {report["duration_s"]:.1f} с '
+            f'({report["rps"]:.0f}/с), отставание p95 '
+            f'{report["lag_p95_ms"]:.1f} мс'))
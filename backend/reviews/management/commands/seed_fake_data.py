@@ -0,0 +1,277 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import accumulate
+
+from api.cache import invalidate
+from api.search import recipe_ingredient_index
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+from reviews.counters import COUNTERS, repair_counter
+from reviews.models import (Cart, Favorite, Ingredient, IngredientsInRecipe,
+                            Recipe, RecipeTag, Subscription, Tag, User)
+
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Сергей',
+               'Елена', 'Дмитрий', 'Наталья', 'Алексей')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев',
+              'Соколов', 'Михайлов', 'Новиков', 'Федоров', 'Морозов')
+ADJECTIVES = ('Домашний', 'Быстрый', 'Острый', 'Сырный', 'Летний',
+              'Пряный', 'Постный', 'Праздничный', 'Бабушкин', 'Легкий')
+DISHES = ('суп', 'салат', 'омлет', 'пирог', 'плов', 'рагу', 'борщ',
+          'соус', 'десерт', 'гуляш', 'жаркое', 'запеканка', 'каша')
+WORDS = ('нарезать', 'обжарить', 'смешать', 'посолить', 'запечь',
+         'отварить', 'добавить', 'перемешать', 'подавать', 'остудить')
+
+# Контекст процесса-воркера, задается в _init_worker
+_context = {}
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса распределения Ципфа для rng.choices."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+def _init_worker(context):
+    # Соединение родителя не переиспользуется после fork
+    connections.close_all()
+    _context.update(context)
+
+
+def _rng(kind, index):
+    return random.Random(f'{_context["seed"]}:{kind}:{index}')
+
+
+def make_users(index, start, count):
+    rng = _rng('users', index)
+    User.objects.bulk_create((
+        User(id=pk, username=f'fake{pk}', email=f'fake{pk}@example.com',
+             first_name=rng.choice(FIRST_NAMES),
+             last_name=rng.choice(LAST_NAMES),
+             password=_context['password'])
+        for pk in range(start, start + count)
+    ), batch_size=_context['batch_size'])
+    return count
+
+
+def make_recipes(index, start, count):
+    rng = _rng('recipes', index)
+    user_ids = _context['user_ids']
+    ingredient_ids = _context['ingredient_ids']
+    now = _context['now']
+    recipes, ingredients, tags = [], [], []
+    for pk in range(start, start + count):
+        recipes.append(Recipe(
+            id=pk,
+            name=f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}',
+            text=' '.join(rng.choices(WORDS, k=rng.randint(5, 30))),
+            cooking_time=max(1, min(int(rng.lognormvariate(3.4, 0.6)), 600)),
+            image='media/recipe/fake.png',
+            author_id=rng.choices(user_ids,
+                                  cum_weights=_context['author_weights'])[0],
+            pub_date=now - timedelta(
+                minutes=rng.randint(0, _context['days'] * 24 * 60)),
+        ))
+        size = max(2, min(int(rng.gauss(8, 3)), 20, len(ingredient_ids)))
+        chosen = set()
+        while len(chosen) < size:
+            chosen.add(rng.choices(
+                ingredient_ids,
+                cum_weights=_context['ingredient_weights'])[0])
+        ingredients.extend(
+            IngredientsInRecipe(recipe_id=pk, ingredient_id=ingredient_id,
+                                amount=rng.randint(1, 500))
+            for ingredient_id in chosen)
+        tags.extend(RecipeTag(recipe_id=pk, tag_id=tag_id) for tag_id in
+                    rng.sample(_context['tag_ids'], rng.randint(1, 3)))
+    batch_size = _context['batch_size']
+    # auto_now_add перезапишет pub_date при вставке, возвращаем его следом
+    dates = {recipe.id: recipe.pub_date for recipe in recipes}
+    Recipe.objects.bulk_create(recipes, batch_size=batch_size)
+    Recipe.objects.bulk_update(
+        [Recipe(id=pk, pub_date=pub_date) for pk, pub_date in dates.items()],
+        ['pub_date'], batch_size=batch_size)
+    IngredientsInRecipe.objects.bulk_create(ingredients,
+                                            batch_size=batch_size)
+    RecipeTag.objects.bulk_create(tags, batch_size=batch_size)
+    return count
+
+
+def make_activity(index, start, count):
+    """Подписки, избранное и корзины пользователей [start, start + count)."""
+    rng = _rng('activity', index)
+    user_ids = _context['user_ids']
+    recipe_ids = _context['recipe_ids']
+    now = _context['now']
+    subscriptions, favorites, carts = [], [], []
+    for user_id in user_ids[start:start + count]:
+        follows = min(int(rng.paretovariate(1.2)) - 1, 1000)
+        authors = set(rng.choices(user_ids,
+                                  cum_weights=_context['author_weights'],
+                                  k=follows))
+        authors.discard(user_id)
+        subscriptions.extend(
+            Subscription(subscriber_id=user_id, subscribed_id=author_id)
+            for author_id in authors)
+        liked = min(int(rng.paretovariate(1.1)) - 1, 500)
+        for recipe_id in set(rng.choices(
+                recipe_ids, cum_weights=_context['recipe_weights'],
+                k=liked)):
+            favorites.append(Favorite(
+                user_id=user_id, recipe_id=recipe_id,
+                created=now - timedelta(
+                    minutes=rng.randint(0, _context['days'] * 24 * 60))))
+        for recipe_id in set(rng.sample(recipe_ids,
+                                        min(rng.randint(0, 4),
+                                            len(recipe_ids)))):
+            carts.append(Cart(user_id=user_id, recipe_id=recipe_id))
+    batch_size = _context['batch_size']
+    Subscription.objects.bulk_create(subscriptions, batch_size=batch_size,
+                                     ignore_conflicts=True)
+    # auto_now_add перезапишет created при вставке, а id с
+    # ignore_conflicts не возвращаются: даты ставим по парам
+    dates = {(favorite.user_id, favorite.recipe_id): favorite.created
+             for favorite in favorites}
+    Favorite.objects.bulk_create(favorites, batch_size=batch_size,
+                                 ignore_conflicts=True)
+    Favorite.objects.bulk_update(
+        [Favorite(id=pk, created=dates[user_id, recipe_id])
+         for pk, user_id, recipe_id in Favorite.objects.filter(
+             user_id__in=user_ids[start:start + count]
+         ).values_list('id', 'user_id', 'recipe_id')
+         if (user_id, recipe_id) in dates],
+        ['created'], batch_size=batch_size)
+    Cart.objects.bulk_create(carts, batch_size=batch_size,
+                             ignore_conflicts=True)
+    return count
+
+
+class Command(BaseCommand):
+    help = ('Generate users, recipes, subscriptions, favorites and carts '
+            'for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Сколько тегов должно быть в базе')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней разбросать даты')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Процессов-воркеров (для SQLite всегда 1)')
+        parser.add_argument(
+            '--password',
+            help='Пароль всех пользователей, по умолчанию вход запрещен')
+        parser.add_argument(
+            '--no-timelines', action='store_true',
+            help='Не заполнять ленты подписок (rebuild_timelines)')
+
+    def run(self, executor, func, first, total, chunk_size, label):
+        """func(index, start, count) по кускам, в пуле или в этом процессе."""
+        chunks = [(index, first + start, min(chunk_size, total - start))
+                  for index, start in enumerate(range(0, total, chunk_size))]
+        started = time.monotonic()
+        if executor is None:
+            done = sum(func(*chunk) for chunk in chunks)
+        else:
+            done = sum(executor.map(func, *zip(*chunks)))
+        self.stdout.write(f'{label}: {done} за '
+                          f'{time.monotonic() - started:.1f} с')
+
+    def get_tag_ids(self, count):
+        existing = list(Tag.objects.values_list('id', flat=True))
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'fake-tag-{number}')
+            for number in range(len(existing), count))
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        if len(ingredient_ids) < 2:
+            raise CommandError('Сначала загрузите ингредиенты: '
+                               'python manage.py load_ingredients')
+        workers = max(options['workers'], 1)
+        if connection.vendor == 'sqlite':
+            workers = 1
+        rng = random.Random(options['seed'])
+        # Популярность ингредиентов и авторов - по Ципфу в случайном
+        # порядке, а не по id
+        rng.shuffle(ingredient_ids)
+        user_start = self.next_id(User)
+        user_ids = list(range(user_start, user_start + options['users']))
+        recipe_start = self.next_id(Recipe)
+        recipe_ids = list(range(recipe_start,
+                                recipe_start + options['recipes']))
+        popular_users = user_ids[:]
+        rng.shuffle(popular_users)
+        popular_recipes = recipe_ids[:]
+        rng.shuffle(popular_recipes)
+        self.context = {
+            'seed': options['seed'],
+            'batch_size': options['batch_size'],
+            'days': options['days'],
+            'now': timezone.now(),
+            'password': (make_password(options['password'])
+                         if options['password'] else make_password(None)),
+            'user_ids': popular_users,
+            'author_weights': zipf_weights(len(user_ids), 1.1),
+            'recipe_ids': popular_recipes,
+            'recipe_weights': zipf_weights(len(recipe_ids), 1.0),
+            'ingredient_ids': ingredient_ids,
+            'ingredient_weights': zipf_weights(len(ingredient_ids), 0.9),
+            'tag_ids': self.get_tag_ids(options['tags']),
+        }
+        chunk_size = options['batch_size']
+        executor = None
+        if workers > 1:
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(self.context,))
+        else:
+            _init_worker(self.context)
+        try:
+            self.run(executor, make_users, user_start, len(user_ids),
+                     chunk_size, 'users')
+            self.run(executor, make_recipes, recipe_start, len(recipe_ids),
+                     chunk_size, 'recipes')
+            # Куски активности - позиции в user_ids, а не id
+            self.run(executor, make_activity, 0, len(user_ids),
+                     chunk_size, 'activity')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self.finish()
+        if not options['no_timelines']:
+            call_command('rebuild_timelines', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с. Для похожих '
+            f'рецептов и популярности запустите rebuild_similarity '
+            f'и recompute_scores --full'))
+
+    def finish(self):
+        # Id заданы явно, последовательности Postgres нужно сдвинуть
+        sequence_sql = connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe])
+        with connection.cursor() as cursor:
+            for sql in sequence_sql:
+                cursor.execute(sql)
+        for field in COUNTERS:
+            repair_counter(field)
+        recipe_ingredient_index.invalidate()
+        invalidate('recipes', shared=True)
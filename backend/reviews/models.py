@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
 from django.db import models
@@ -36,6 +37,12 @@ class User(AbstractUser):
     role = models.CharField(
         'Роль', max_length=10, default='user'
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов', default=0
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Количество подписчиков', default=0
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name', 'password']
 
@@ -43,6 +50,10 @@ class User(AbstractUser):
         verbose_name = "пользователя"
         verbose_name_plural = "пользователи"
         ordering = ['date_joined']
+        indexes = [
+            models.Index(fields=['date_joined', 'id'],
+                         name='user_date_joined_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.last_name} {self.first_name}'
@@ -129,11 +140,44 @@ class Recipe(models.Model):
     short_link = models.URLField(
         'Сокращенная ссылка'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Количество в избранном', default=0
+    )
+    carts_count = models.PositiveIntegerField(
+        'Количество в корзинах', default=0
+    )
+    # Выставляется задачей api.images.generate_thumbnails
+    has_thumbnails = models.BooleanField(
+        'Миниатюры созданы', default=False, editable=False
+    )
+    # Пересчитываются командой recompute_scores (reviews/scores.py)
+    popular_score = models.FloatField(
+        'Популярность', default=0, editable=False
+    )
+    trending_score = models.FloatField(
+        'Популярность с затуханием', default=0, editable=False
+    )
+    # Заполняется триггером Postgres (reviews/indexes.py)
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False
+    )
 
     class Meta:
         verbose_name = "рецепт"
         verbose_name_plural = "рецепты"
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['cooking_time'],
+                         name='recipe_cooking_time_idx'),
+            models.Index(fields=['-popular_score', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['-trending_score', '-id'],
+                         name='recipe_trending_idx'),
+        ]
         default_related_name = '%(class)ss'
 
     def __str__(self):
@@ -151,6 +195,11 @@ class RecipeTag(models.Model):
                 name='unique_tag_recipe'
             )
         ]
+        indexes = [
+            # EXISTS по тегам ищет строки конкретного рецепта
+            models.Index(fields=['recipe', 'tag'],
+                         name='recipetag_recipe_tag_idx'),
+        ]
         verbose_name = "тег к рецепту"
         verbose_name_plural = "теги к рецепту"
 
@@ -181,7 +230,7 @@ class IngredientsInRecipe(models.Model):
 
 class ShortLinkRecipe(models.Model):
     short_link = models.CharField('Короткая ссылка',
-                                  max_length=20, null=True)
+                                  max_length=20, null=True, unique=True)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     full_link = models.URLField('Полная ссылка',
                                 max_length=100, default=None)
@@ -194,11 +243,110 @@ class ShortLinkRecipe(models.Model):
         return f'Ссылка для рецепта {self.recipe}'
 
 
+class RecipeSignature(models.Model):
+    """MinHash-подпись множества ингредиентов и тегов рецепта."""
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, primary_key=True,
+        related_name='signature', verbose_name='Рецепт'
+    )
+    minhash = models.BinaryField('MinHash-подпись')
+
+    class Meta:
+        verbose_name = "подпись рецепта"
+        verbose_name_plural = "подписи рецептов"
+
+    def __str__(self):
+        return f'Подпись рецепта {self.recipe_id}'
+
+
+class RecipeBucket(models.Model):
+    """Корзина LSH: рецепты с одинаковым key похожи хотя бы
+    в одной полосе подписи."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField('Полоса')
+    key = models.BigIntegerField('Ключ корзины')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'band'),
+                name='unique_recipe_band'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['key', 'recipe'],
+                         name='recipebucket_key_recipe_idx'),
+        ]
+        verbose_name = "корзина LSH"
+        verbose_name_plural = "корзины LSH"
+        default_related_name = '%(class)ss'
+
+    def __str__(self):
+        return f'Корзина {self.key} рецепта {self.recipe_id}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика, записанный при публикации."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline',
+                             verbose_name='Подписчик')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='timeline_entries',
+                               verbose_name='Рецепт')
+    # Копия recipe.pub_date, чтобы лента читалась по одному индексу
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_timeline_user_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+        verbose_name = "запись ленты"
+        verbose_name_plural = "записи ленты"
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
+
+
+class Watermark(models.Model):
+    """До какого момента периодическая задача обработала данные."""
+    name = models.CharField('Задача', max_length=64, unique=True)
+    value = models.DateTimeField('Обработано до')
+
+    class Meta:
+        verbose_name = "отметка обработки"
+        verbose_name_plural = "отметки обработки"
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class IndexVersion(models.Model):
+    """Версия данных индекса, который процессы держат в памяти."""
+    name = models.CharField('Индекс', max_length=64, unique=True)
+    value = models.PositiveBigIntegerField('Версия', default=0)
+
+    class Meta:
+        verbose_name = "версия индекса"
+        verbose_name_plural = "версии индексов"
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
 class BaseUserRecipeModel(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              null=True)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                null=True)
+    created = models.DateTimeField('Дата добавления', auto_now_add=True,
+                                   db_index=True)
 
     class Meta:
         abstract = True
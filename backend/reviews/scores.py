@@ -0,0 +1,84 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone as django_timezone
+
+from .models import Cart, Favorite, Recipe, Watermark
+from .signals import scores_updated
+
+# Вес действия в оценке: избранное значит больше, чем корзина
+WEIGHTS = {Favorite: 2, Cart: 1}
+# Точка отсчета затухания, менять нельзя без полного пересчета
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WATERMARK = 'scores'
+# created ставится при вставке, а видна строка после коммита: действия
+# из долгих транзакций могут оказаться раньше прошлого запуска
+SAFETY_MARGIN = timedelta(minutes=5)
+BATCH_SIZE = 1000
+
+
+def decay_exponent(moment):
+    """ln(2) * (moment - EPOCH) / период полураспада."""
+    hours = (moment - EPOCH).total_seconds() / 3600
+    return math.log(2) * hours / settings.TRENDING_HALF_LIFE_HOURS
+
+
+def trending_score(activity):
+    """Логарифм суммы весов с прямым затуханием (forward decay)."""
+    exponents = [math.log(weight) + decay_exponent(created)
+                 for weight, created in activity]
+    if not exponents:
+        return 0
+    top = max(exponents)
+    return top + math.log(sum(math.exp(value - top) for value in exponents))
+
+
+def recompute_scores(recipe_ids):
+    """Пересчитывает popular_score и trending_score рецептов."""
+    activity = {recipe_id: [] for recipe_id in recipe_ids}
+    for model, weight in WEIGHTS.items():
+        for recipe_id, created in model.objects.filter(
+                recipe_id__in=recipe_ids).values_list('recipe_id', 'created'):
+            activity[recipe_id].append((weight, created))
+    recipes = [
+        Recipe(id=recipe_id,
+               popular_score=sum(weight for weight, _ in actions),
+               trending_score=trending_score(actions))
+        for recipe_id, actions in activity.items()
+    ]
+    Recipe.objects.bulk_update(
+        recipes, ['popular_score', 'trending_score'], batch_size=BATCH_SIZE)
+    scores_updated.send(sender=Recipe, recipe_ids=recipe_ids)
+    return len(recipes)
+
+
+def get_changed_recipes(since):
+    """Рецепты с новыми действиями после since, None - все рецепты
+    с действиями или ненулевой оценкой."""
+    if since is None:
+        return Recipe.objects.filter(
+            Q(favorites__isnull=False) | Q(carts__isnull=False)
+            | ~Q(popular_score=0)
+        ).values_list('id', flat=True).distinct()
+    changed = set()
+    for model in WEIGHTS:
+        changed.update(model.objects.filter(
+            created__gte=since).values_list('recipe_id', flat=True))
+    changed.discard(None)
+    return sorted(changed)
+
+
+def refresh_scores(full=False):
+    """Пересчитывает оценки рецептов с действиями после прошлого запуска."""
+    started = django_timezone.now()
+    since = None if full else Watermark.objects.filter(
+        name=WATERMARK).values_list('value', flat=True).first()
+    recipe_ids = list(get_changed_recipes(since))
+    updated = 0
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        updated += recompute_scores(recipe_ids[start:start + BATCH_SIZE])
+    Watermark.objects.update_or_create(
+        name=WATERMARK, defaults={'value': started - SAFETY_MARGIN})
+    return updated
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Оценки рецептов пересчитаны, аргумент recipe_ids
+scores_updated = Signal()